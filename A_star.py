@@ -1,4 +1,5 @@
 from functools import lru_cache
+from Movement import FOUR_CONNECTED
 from PriorityQueue import PriorityQueue
 from common import get_path_from_parent_map, visitable
 
@@ -12,8 +13,32 @@ def _adjacent_nodes(node):
 	return [(y, x - 1), (y - 1, x), (y, x + 1), (y + 1, x)]
 
 
-def a_star(Map, start, goal, h):
-	frontier = PriorityQueue()
+def a_star(Map, start, goal, h, queue=PriorityQueue, connected=None, model=FOUR_CONNECTED, costs=None):
+	"""A* search on the grid Map.
+
+	Args:
+		Map: 2D numpy array containing zeros and ones
+		start: address of the start node
+		goal: address of the goal node
+		h: heuristic function
+		queue: class of the open list, e.g. PriorityQueue, IndexedHeap or 
+			BucketQueue (if h only returns integers)
+		connected: optional function (node1, node2) telling if two free cells 
+			are connected, e.g. BlockMap.connected of a BlockMap of Map. If 
+			given, queries between free cells that are not connected fail 
+			without searching.
+		model: movement model, see Movement.MovementModel. h must be 
+			admissible for it, e.g. model.h.
+		costs: optional array of positive integers of the shape of Map: 
+			the cost multiplier of each cell, e.g. BlockMap.cell_costs(). A 
+			move into a cell costs the move's cost times the cell's multiplier.
+
+	Returns:
+		(goal_found, path)
+	"""
+	if connected is not None and Map[start] == 0 and Map[goal] == 0 and not connected(start, goal):
+		return False, []
+	frontier = queue()
 	parent_map = {}
 	g = {}
 
@@ -22,14 +47,19 @@ def a_star(Map, start, goal, h):
 	parent_map[start] = None
 	frontier.push(start, 0)
 
+	if model is FOUR_CONNECTED:
+		neighbors = lambda node: [(nghb, 1) for nghb in _neighbors(Map, node)]
+	else:
+		neighbors = lambda node: model.neighbors(Map, node)
+
 	while len(frontier) > 0:
 		current = frontier.pop()
 		if current == goal:
 			goal_found = True
 			break
 
-		for nghb in _neighbors(Map, current):
-			new_g = g[current] + 1
+		for nghb, cost in neighbors(current):
+			new_g = g[current] + (cost if costs is None else cost * int(costs[nghb]))
 			if nghb not in g or new_g < g[nghb]:
 				g[nghb] = new_g
 				priority = new_g + h(nghb, goal)
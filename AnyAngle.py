@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def supercover_cells(node1, node2):
+	"""Cells crossed by the segment between the centers of node1 and node2,
+	in order. Where the segment passes exactly through a corner, both cells
+	next to it are included, so a line never squeezes between two diagonal
+	obstacles.
+
+	Returns:
+		array of shape (n, 2) of the addresses of the cells
+	"""
+	(y, x), (y1, x1) = node1, node2
+	dy, dx = abs(y1 - y), abs(x1 - x)
+	sy = 1 if y1 > y else -1
+	sx = 1 if x1 > x else -1
+	cells = [(y, x)]
+	# ix, iy = number of vertical, horizontal cell edges crossed so far. The
+	# next ones are crossed at t = (2 * ix + 1) / (2 * dx) and
+	# (2 * iy + 1) / (2 * dy) along the segment.
+	ix = iy = 0
+	while ix < dx or iy < dy:
+		cmp = (2 * ix + 1) * dy - (2 * iy + 1) * dx
+		if cmp == 0:
+			cells.append((y, x + sx))
+			cells.append((y + sy, x))
+			y, x, iy, ix = y + sy, x + sx, iy + 1, ix + 1
+		elif cmp < 0:
+			x, ix = x + sx, ix + 1
+		else:
+			y, iy = y + sy, iy + 1
+		cells.append((y, x))
+	return np.array(cells)
+
+
+def line_of_sight(block_map, node1, node2):
+	"""True if the segment between the centers of node1 and node2 only
+	crosses free cells of block_map.
+
+	The cells of the segment are checked in one batch against the block
+	indices: each cell is turned into the bit of its block index (see Block)
+	and the line is blocked if any of these bits is set.
+	"""
+	b = block_map.block_size
+	ys, xs = supercover_cells(node1, node2).T
+	idxs = block_map.idxs[ys // b, xs // b].astype(np.int64)
+	bits = np.left_shift(1, (ys % b) * b + xs % b, dtype=np.int64)
+	return not np.any(idxs & bits)
+
+
+def smooth_path(block_map, path):
+	"""Shorten a grid path into an any-angle path by string pulling: from
+	each waypoint, the path goes straight to the farthest following node
+	of `path` that is in line of sight, as found by scanning forward.
+
+	Args:
+		block_map: the BlockMap the path is on
+		path: list of the nodes of a path, as returned by block_a_star
+
+	Returns:
+		list of the waypoints of the any-angle path, the first and last
+		nodes of path included. Consecutive waypoints are in line of sight.
+	"""
+	if len(path) < 3:
+		return list(path)
+	waypoints = [path[0]]
+	for prev, node in zip(path[1:], path[2:]):
+		if not line_of_sight(block_map, waypoints[-1], node):
+			waypoints.append(prev)
+	waypoints.append(path[-1])
+	return waypoints
+
+
+def euclidean_length(path):
+	"""Euclidean length of the polyline through the nodes of `path`"""
+	if len(path) < 2:
+		return 0.
+	return float(np.hypot(*np.diff(np.asarray(path, dtype=float), axis=0).T).sum())
@@ -1,9 +1,18 @@
 from collections import deque
 from functools import lru_cache
 
+import numpy as np
+
 from common import is_visitable, visitable
 
 
+# sides of a block, as the direction of the neighbor block on that side: 
+# left, up, right, down. Side d and side (d + 2) % 4 face each other.
+DIRECTIONS = ((0, -1), (-1, 0), (0, 1), (1, 0))
+# diagonal neighbor blocks, sides 4 to 7 of a block for movement models with 
+# diagonal moves (see Movement.MovementModel)
+CORNERS = ((-1, -1), (-1, 1), (1, 1), (1, -1))
+
 class InvalidNodeError(Exception):
 	pass
 
@@ -69,6 +78,165 @@ def boundary_nodes(block):
 	return top + bottom + left + right
 
 
+@lru_cache(None)
+def boundary_slots(size):
+	"""Number the boundary nodes of a size x size block.
+
+	Returns:
+		A tuple of: the list of boundary nodes in slot order and a nested list
+		`slot` such that slot[y][x] is the slot of node (y, x), or -1 for
+		interior nodes.
+	"""
+	nodes = []
+	slot = [[-1] * size for _ in range(size)]
+	for y, x in boundary_nodes(Block(0, size)):
+		if slot[y][x] < 0:
+			slot[y][x] = len(nodes)
+			nodes.append((y, x))
+	return nodes, slot
+
+
+@lru_cache(None)
+def bit_masks(size):
+	"""Masks for shift-and-mask operations on block indices.
+
+	Returns:
+		A tuple of: the mask with all size**2 bits set, the mask of nodes not 
+		in the first column and the mask of nodes not in the last column.
+	"""
+	full = (1 << size**2) - 1
+	first_col = sum(1 << (y * size) for y in range(size))
+	last_col = first_col << (size - 1)
+	return full, full & ~first_col, full & ~last_col
+
+
+def expand_bits(bits, size):
+	"""Nodes 4-adjacent to the nodes in `bits`, a set of nodes encoded like 
+	a block index. Works on Python ints as well as on numpy uint64 arrays, 
+	for which each element is expanded independently.
+	"""
+	full, not_first_col, not_last_col = bit_masks(size)
+	return (
+		((bits & not_last_col) << 1) | ((bits & not_first_col) >> 1) |
+		(bits << size) | (bits >> size)
+	) & full
+
+
+@lru_cache(2**16)
+def block_components(idx, size):
+	"""4-connected components of the free nodes of the block with index `idx`, 
+	as a tuple of node sets encoded like block indices. Each component is 
+	grown from its lowest node by repeated expand_bits until it stops changing.
+	"""
+	free = ~idx & bit_masks(size)[0]
+	components = []
+	while free:
+		component = free & -free
+		while True:
+			grown = (component | expand_bits(component, size)) & free
+			if grown == component:
+				break
+			component = grown
+		components.append(component)
+		free &= ~component
+	return tuple(components)
+
+
+@lru_cache(None)
+def side_cells(size):
+	"""Cells on the sides of a size x size block.
+
+	Returns:
+		A dict mapping each direction in DIRECTIONS to the list of pairs 
+		(cell, neighbor cell) on that side: the k-th cell along the side and 
+		the cell it is adjacent to in the neighbor block in that direction. 
+		Bit k of a side mask (see side_bits) refers to the k-th pair.
+	"""
+	b = size - 1
+	sides = {
+		(0, -1): lambda k: ((k, 0), (k, b)),
+		(-1, 0): lambda k: ((0, k), (b, k)),
+		(0, 1) : lambda k: ((k, b), (k, 0)),
+		(1, 0) : lambda k: ((b, k), (0, k)),
+	}
+	return {
+		d: [(y * size + x, ny * size + nx) for (y, x), (ny, nx) in map(side, range(size))]
+		for d, side in sides.items()
+	}
+
+
+def side_bits(idx, size):
+	"""Free cells on each side of the block with index `idx`, as a tuple of 
+	masks in the order of DIRECTIONS. Bit k of a mask is set iff the k-th 
+	cell of the side is free (see side_cells).
+
+	The egress mask of a side of a block is the AND of its side mask and 
+	the opposite side mask of the neighbor block on that side.
+	"""
+	free = ~idx & bit_masks(size)[0]
+	b = size - 1
+	first_row = free & ((1 << size) - 1)
+	last_row = free >> (b * size)
+	first_col = last_col = 0
+	for k in range(size):
+		first_col |= ((free >> (k * size)) & 1) << k
+		last_col |= ((free >> (k * size + b)) & 1) << k
+	return first_col, first_row, last_col, last_row
+
+
+@lru_cache(None)
+def dihedral_transforms(size):
+	"""The 8 rotations and reflections of a size x size block, as permutations 
+	of its nodes: transform `perm` moves node y * size + x to node perm[y * size + x].
+	The first transform is the identity.
+	"""
+	b = size - 1
+	transforms = [
+		lambda y, x: (y    , x    ),
+		lambda y, x: (x    , b - y),
+		lambda y, x: (b - y, b - x),
+		lambda y, x: (b - x, y    ),
+		lambda y, x: (y    , b - x),
+		lambda y, x: (b - y, x    ),
+		lambda y, x: (x    , y    ),
+		lambda y, x: (b - x, b - y),
+	]
+	perms = []
+	for t in transforms:
+		perm = []
+		for c in range(size**2):
+			y, x = t(*divmod(c, size))
+			perm.append(y * size + x)
+		perms.append(perm)
+	return perms
+
+
+def transform_idx(idx, perm):
+	"""Apply a node permutation (see dihedral_transforms) to a block index.
+	Works on Python ints as well as on numpy uint64 arrays."""
+	out = idx & 0
+	for c, new_c in enumerate(perm):
+		out |= ((idx >> c) & 1) << new_c
+	return out
+
+
+def canonical_blocks(idxs, size):
+	"""Canonical representatives of blocks under rotations and reflections.
+
+	Args:
+		idxs: numpy uint64 array of block indices
+		size: size of blocks
+
+	Returns:
+		A tuple of: the canonical block index of each block, i.e. the smallest 
+		index among its rotations and reflections, and the index of the transform 
+		in dihedral_transforms(size) that maps the block to it.
+	"""
+	transformed = np.stack([transform_idx(idxs, perm) for perm in dihedral_transforms(size)])
+	transform = transformed.argmin(axis=0)
+	return transformed[transform, np.arange(len(idxs))], transform.astype(np.uint8)
+
+
 def is_boundary_node(block, node):
 	y, x = node
 	b = len(block) - 1
@@ -0,0 +1,94 @@
+from time import perf_counter
+
+import numpy as np
+from Block_A_star import new_state, search, get_block_neighbors
+from Movement import FOUR_CONNECTED
+from PriorityQueue import PriorityQueue
+from common import l1_dist
+
+
+class BlockAStarSolver(object):
+	def __init__(self, block_map, lddb, pathsdb, h=l1_dist, queue=PriorityQueue, model=FOUR_CONNECTED):
+		"""Answers many Block A* queries on the same map.
+
+		The neighbors of each block are cached across queries, and a single 
+		state dict is reused for all of them. The egress masks of the block 
+		sides are kept up to date by the BlockMap itself when the map is 
+		changed with BlockMap.set_cells or BlockMap.update_region.
+
+		Args:
+			block_map: the BlockMap to be searched
+			lddb: local distance database
+			pathsdb: local paths database
+			h: heuristic function
+			queue: class of the open list, see block_a_star
+			model: movement model of lddb and pathsdb, see block_a_star
+		"""
+		super(BlockAStarSolver, self).__init__()
+		self.block_map = block_map
+		self.lddb = lddb
+		self.pathsdb = pathsdb
+		self.h = h
+
+		# block id -> result of get_block_neighbors
+		self._neighbors = {}
+		self._state = new_state(lddb, pathsdb, block_map, 
+			block_neighbors=self._block_neighbors, queue=queue, model=model)
+
+	def _block_neighbors(self, state, block):
+		nbs = self._neighbors.get(block)
+		if nbs is None:
+			nbs = get_block_neighbors(state, block)
+			self._neighbors[block] = nbs
+		return nbs
+
+	def query(self, start, goal, bound=np.inf, with_paths=True, precheck=False):
+		"""Search for a path from start to goal without reconstructing it.
+
+		Args:
+			bound, with_paths, precheck: see block_a_star
+
+		Returns:
+			The SearchResult of the search, see block_a_star. Its stats also 
+			hold the search time in seconds.
+		"""
+		t1 = perf_counter()
+		result = search(self._state, start, goal, self.h, bound, with_paths, precheck)
+		result.stats.time = perf_counter() - t1
+		return result
+
+	def distance(self, start, goal, bound=np.inf):
+		"""Length of the shortest path from start to goal, inf if there is 
+		none or if it is longer than `bound`. Parents and paths are not tracked."""
+		return self.query(start, goal, bound, with_paths=False, precheck=True).length
+
+	def reachable(self, start, goal, bound=np.inf):
+		"""True if goal can be reached from start within `bound` steps. 
+		Without a bound, this is answered from the connected components of 
+		the map when start and goal are free."""
+		Map = self.block_map
+		if bound == np.inf and Map._map[start] == 0 and Map._map[goal] == 0:
+			return Map.connected(start, goal)
+		return self.distance(start, goal, bound) < np.inf
+
+	def solve(self, start, goal, any_angle=False):
+		"""Find a path from start to goal.
+
+		Args:
+			any_angle: if True, return the waypoints of the path smoothed 
+				into an any-angle path (see SearchResult.any_angle_path) 
+				instead of all its cells
+
+		Returns:
+			A tuple of (goal_found, path, stats), where goal_found and path 
+			are as returned by block_a_star and stats holds the number of
+			expanded blocks, the path length and the search time in seconds.
+		"""
+		result = self.query(start, goal)
+		path = result.any_angle_path() if any_angle else result.path
+		return result.goal_found, path, result.stats
+
+	def solve_many(self, pairs):
+		"""Solve a sequence of (start, goal) pairs. Returns a list of the
+		results of solve for each pair."""
+		return [self.solve(start, goal) for start, goal in pairs]
@@ -2,55 +2,230 @@ from time import perf_counter
 from collections import defaultdict
 
 import numpy as np
-from Block import Block, list_to_block_idx
+from Block import Block, DIRECTIONS, side_bits
 from PriorityQueue import PriorityQueue
+from Connectivity import ConnectivityIndex
 
 
 class BlockMap(object):
-	def __init__(self, Map, block_size):
+	def __init__(self, Map, block_size, costs=None, idxs=None, egress=None, copy=True):
 		"""Holds the grid of blocks representing the map
 
 		Args:
 			Map: 2D numpy array containing zeros and ones
 			block_size: Map will be divided into block_size x block_size blocks
+			costs: optional array of positive integers of shape (h, w), the 
+				number of blocks of the (expanded) map: the cost multiplier 
+				of the cells of each block. A move into a cell costs the cost 
+				of the move (see Movement.MovementModel) times the multiplier 
+				of the cell's block. Defaults to 1 for all blocks.
+			idxs: optional precomputed block indices of Map, as self.idxs of 
+				another BlockMap of the same map
+			egress: optional precomputed egress masks of Map, as self.egress 
+				of another BlockMap of the same map
+			copy: if False, a Map that is already expanded (a uint8 array of 
+				zeros and ones whose sides are multiples of block_size) and the 
+				given idxs, egress and costs arrays are used as they are, e.g. 
+				arrays in shared memory, instead of being copied. Edits of the 
+				BlockMap then write to them.
 		"""
 		super(BlockMap, self).__init__()
 
 		self.block_size = block_size
 		# expand map if not divisible by block size
-		Map = self._expand_map(Map)
+		Map = self._expand_map(Map, copy)
 		self._map = Map
 
 		h, w = Map.shape[0] // block_size, Map.shape[1] // block_size
 		self.h, self.w = h, w
-		self.blocks = [[None] * w for _ in range(h)]
-
-		for i in range(h):
-			for j in range(w):
-				block_slice = Map[i * block_size: (i + 1) * block_size, j * block_size: (j + 1) * block_size]
-				block_idx = list_to_block_idx(block_slice)
-				self.blocks[i][j] = Block(block_idx, block_size, map_addr=(i, j))
+		# arrays passed in are copied unless copy is False
+		array = np.array if copy else np.asarray
+		# idxs[i, j] = index of block (i, j), see Block
+		self.idxs = self._block_idxs(Map) if idxs is None else array(idxs)
+		self.costs = np.ones((h, w), dtype=np.int64) if costs is None else array(costs, dtype=np.int64)
+		assert self.costs.shape == (h, w) and (self.costs >= 1).all()
+		# egress[i, j, d] = mask of the valid egress nodes on side d (see 
+		# Block.DIRECTIONS) of block (i, j): bit k is set iff the k-th cell on 
+		# that side and the cell next to it in the neighbor block are both free
+		self.egress = self._egress_masks(Map) if egress is None else array(egress)
+		# Block objects are only created when they are first accessed
+		self._blocks = {}
+		# functions called with the addresses of changed blocks after an update
+		self._listeners = []
+		# ConnectivityIndex of the map, created when first needed
+		self._connectivity = None
 
 	def __getitem__(self, key):
-		y, x = key
-		return self.blocks[y][x]
+		block = self._blocks.get(key)
+		if block is None:
+			y, x = key
+			block = Block(int(self.idxs[y, x]), self.block_size, map_addr=(y, x))
+			self._blocks[key] = block
+		return block
 
 	def __setitem__(self, key, value):
+		b = self.block_size
 		y, x = key
-		self.blocks[y][x] = value
+		self._map[y * b: (y + 1) * b, x * b: (x + 1) * b] = np.array(
+			[(value.idx >> c) & 1 for c in range(b * b)], dtype=np.uint8).reshape(b, b)
+		self._blocks[key] = value
+		self._set_block_idxs({key: value.idx})
 
-	def _expand_map(self, Map):
+	def _expand_map(self, Map, copy=True):
 		"""Pad map with ones to make its h and w so that it is 
 		evenly divisible into blocks.
 		"""
 		map_h, map_w = Map.shape
-		rem_h, rem_w = map_h % self.block_size, map_w % self.block_size
-		if rem_h > 0:
-			Map = np.concatenate((Map, np.ones((rem_h, map_w))), axis=0)
-		if rem_w > 0:
-			Map = np.concatenate((Map, np.ones((map_h + rem_h, rem_w))), axis=1)
-		return Map
+		pad_h, pad_w = -map_h % self.block_size, -map_w % self.block_size
+		if not copy and not pad_h and not pad_w and Map.dtype == np.uint8:
+			return Map
+		return np.pad(Map != 0, ((0, pad_h), (0, pad_w)), constant_values=1).astype(np.uint8)
+
+	def _block_idxs(self, Map):
+		"""Indices of all blocks of the (expanded) map, or of a block-aligned 
+		part of it, computed at once by reshaping the map into a (h, w, block_size**2) 
+		array of block entries and taking its dot product with the bit weights 
+		of the entries.
+		"""
+		b = self.block_size
+		h, w = Map.shape[0] // b, Map.shape[1] // b
+		bits = Map.reshape(h, b, w, b).transpose(0, 2, 1, 3).reshape(h, w, b * b)
+		if b * b <= 64:
+			weights = np.uint64(1) << np.arange(b * b, dtype=np.uint64)
+			return bits.astype(np.uint64) @ weights
+		# indices too large for 64 bits are kept as Python ints
+		weights = np.array([1 << k for k in range(b * b)], dtype=object)
+		return bits.astype(object) @ weights
+
+	def _egress_masks(self, Map):
+		"""Egress masks of all blocks of the (expanded) map. The map is padded 
+		with a ring of obstacle blocks, so that sides on the map's border get 
+		empty masks, and the masks of all sides are then computed at once from 
+		the (h, block_size, w, block_size) view of the map."""
+		b = self.block_size
+		h, w = Map.shape[0] // b, Map.shape[1] // b
+		free = np.pad(Map == 0, b).reshape(h + 2, b, w + 2, b)
+		inner = free[1:-1, :, 1:-1]
+		sides = [
+			(inner[:, :, :, 0] & free[1:-1, :, :-2, b - 1]).transpose(0, 2, 1),
+			inner[:, 0] & free[:-2, b - 1, 1:-1],
+			(inner[:, :, :, b - 1] & free[1:-1, :, 2:, 0]).transpose(0, 2, 1),
+			inner[:, b - 1] & free[2:, 0, 1:-1],
+		]
+		weights = np.int64(1) << np.arange(b, dtype=np.int64)
+		return np.stack([side @ weights for side in sides], axis=-1)
+
+	def _update_egress(self, addrs):
+		"""Recompute the egress masks of the blocks at `addrs` and those of their 
+		neighbors' sides facing them."""
+		b = self.block_size
+		for y, x in addrs:
+			sides = side_bits(int(self.idxs[y, x]), b)
+			for d, (dy, dx) in enumerate(DIRECTIONS):
+				ny, nx = y + dy, x + dx
+				if not self._is_valid(ny, nx):
+					continue
+				opposite = (d + 2) % 4
+				mask = sides[d] & side_bits(int(self.idxs[ny, nx]), b)[opposite]
+				self.egress[y, x, d] = mask
+				self.egress[ny, nx, opposite] = mask
+
+	def set_cells(self, cells, value):
+		"""Set the given cells of the map to `value` and update the affected blocks.
+		Takes time proportional to the number of cells.
+
+		Args:
+			cells: iterable of global (y, x) addresses
+			value: 0 (free) or 1 (obstacle)
+		"""
+		b = self.block_size
+		value = int(value != 0)
+		new_idxs = {}
+		for y, x in cells:
+			self._map[y, x] = value
+			addr = (y // b, x // b)
+			idx = new_idxs.get(addr)
+			if idx is None:
+				idx = int(self.idxs[addr])
+			bit = 1 << ((y % b) * b + x % b)
+			new_idxs[addr] = (idx | bit) if value else (idx & ~bit)
+		self._set_block_idxs(new_idxs)
+
+	def update_region(self, region, values):
+		"""Overwrite a rectangular region of the map and update the affected blocks.
+		Takes time proportional to the area of the blocks overlapping the region.
 
+		Args:
+			region: a pair of slices (rows, columns) of the map, with steps of 1
+			values: 2D array of zeros and ones to write into the region
+		"""
+		rows, cols = region
+		self._map[rows, cols] = np.asarray(values) != 0
+		y0, y1, _ = rows.indices(self._map.shape[0])
+		x0, x1, _ = cols.indices(self._map.shape[1])
+		b = self.block_size
+		by0, by1 = y0 // b, -(-y1 // b)
+		bx0, bx1 = x0 // b, -(-x1 // b)
+		idxs = self._block_idxs(self._map[by0 * b: by1 * b, bx0 * b: bx1 * b])
+		self._set_block_idxs({
+			(by0 + i, bx0 + j): idxs[i, j] for i in range(by1 - by0) for j in range(bx1 - bx0)
+		})
+
+	def _set_block_idxs(self, new_idxs):
+		"""Set the indices of the given blocks. Cached Block objects are updated 
+		in place, so references to them stay valid. Listeners are notified of 
+		the blocks whose index has changed, after their egress masks have been 
+		updated."""
+		changed = []
+		for addr, idx in new_idxs.items():
+			if idx == self.idxs[addr]:
+				continue
+			self.idxs[addr] = idx
+			block = self._blocks.get(addr)
+			if block is not None:
+				block.idx = int(idx)
+			changed.append(addr)
+		if changed:
+			self._update_egress(changed)
+			for listener in self._listeners:
+				listener(changed)
+
+	def set_costs(self, addrs, cost):
+		"""Set the cost multiplier of the blocks at map addresses `addrs` to 
+		`cost`, a positive integer. Listeners are notified of the blocks 
+		whose cost has changed."""
+		assert cost >= 1
+		changed = [addr for addr in addrs if self.costs[addr] != cost]
+		for addr in changed:
+			self.costs[addr] = cost
+		if changed:
+			for listener in self._listeners:
+				listener(changed)
+
+	def cell_costs(self):
+		"""Cost multipliers of all cells of the (expanded) map, e.g. for a_star"""
+		b = self.block_size
+		return np.repeat(np.repeat(self.costs, b, axis=0), b, axis=1)
+
+	def add_listener(self, listener):
+		"""Register a function to be called with the list of addresses of 
+		changed blocks whenever the map is updated. Used to invalidate data 
+		cached per block."""
+		self._listeners.append(listener)
+
+	def remove_listener(self, listener):
+		"""Unregister a function registered with add_listener. An object that 
+		registers a listener must remove it when it is discarded, or the map 
+		keeps it alive and keeps calling it."""
+		self._listeners.remove(listener)
+
+	def connected(self, node1, node2):
+		"""True if there is a path between the cells node1 and node2. 
+		Answered by the map's ConnectivityIndex, which is built on the first 
+		call and then kept up to date as the map is changed."""
+		if self._connectivity is None:
+			self._connectivity = ConnectivityIndex(self)
+		return self._connectivity.connected(node1, node2)
 
 	def block_neighbors(self, block):
 		adjacent_blocks = self.adjacent_blocks(block.map_addr)
@@ -59,8 +234,7 @@ class BlockMap(object):
 
 	def adjacent_blocks(self, node):
 		y, x = node
-		dirs = [(0, -1), (-1, 0), (0, 1), (1, 0)]
-		return [((y + d[0], x + d[1]), d) for d in dirs]
+		return [((y + d[0], x + d[1]), d) for d in DIRECTIONS]
 
 	def _is_valid(self, y, x):
 		return (0 <= y < self.h) and (0 <= x < self.w)
@@ -68,5 +242,5 @@ class BlockMap(object):
 	def get_node_block(self, node_addr):
 		y, x = node_addr
 		by, bx = y // self.block_size, x // self.block_size
-		return self.blocks[by][bx], (y % self.block_size, x % self.block_size)
+		return self[by, bx], (y % self.block_size, x % self.block_size)
 
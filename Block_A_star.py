@@ -2,11 +2,17 @@ from time import perf_counter
 from collections import defaultdict
 
 import numpy as np
-from Block import boundary_nodes
+from AnyAngle import smooth_path
+from Block import DIRECTIONS, boundary_slots, side_cells
 from PriorityQueue import PriorityQueue
-from LDDB import bfs_to_all_points
+from LDDB import DictLDDB, local_search
+from Movement import FOUR_CONNECTED
 from visualizations import *
-from common import AttrDict, get_path_from_parent_map, is_visitable, visitable
+from common import AttrDict
+
+
+# relative tolerance of the bound of a search with non-integer move costs
+BOUND_TOLERANCE = 1e-9
 
 
 # As descibed in the paper:
@@ -32,7 +38,7 @@ from common import AttrDict, get_path_from_parent_map, is_visitable, visitable
 #	 	return Failure
 #	 end if
 
-def block_a_star(lddb, pathsdb, Map, start, goal, h):
+def block_a_star(lddb, pathsdb, Map, start, goal, h, queue=PriorityQueue, bound=np.inf, with_paths=True, precheck=False, model=FOUR_CONNECTED):
 	"""Block A* search. Implementation of Algorithm 2 from the paper:
 
 	Yap, P., Burch, N., Holte, R. C., & Schaeffer, J. (2011, August). 
@@ -40,53 +46,250 @@ def block_a_star(lddb, pathsdb, Map, start, goal, h):
 	In Twenty-Fifth AAAI Conference on Artificial Intelligence.
 
 	Args:
-		lddb: local distance database
+		lddb: local distance database, either the list of dicts or the ArrayLDDB 
+			returned by make_lddb
 		pathsdb: local paths database
 		Map: a BlockMap representing the map to be searched
 		start: global address of the start node
 		goal: global address of the goal node
 		h: heuristic function
+		queue: class of the open list, e.g. PriorityQueue, IndexedHeap or 
+			BucketQueue (if h only returns integers)
+		bound: only look for paths of length at most `bound`. Blocks whose 
+			heap value exceeds it are pruned, and the goal is reported as 
+			not found if it is farther away.
+		with_paths: if False, parents are not tracked, so only the length 
+			of the path is found. pathsdb may then be None.
+		precheck: if True, first check that start and goal are in the same 
+			connected component of Map (see BlockMap.connected), and fail 
+			at once if they are not
+		model: movement model (see Movement.MovementModel) that lddb and 
+			pathsdb were built for, e.g. make_lddb(block_size, model=OCTILE). 
+			h must be admissible for it, e.g. model.h. The cost multipliers 
+			of the blocks of Map (see BlockMap.costs) are applied on top.
 
 	Returns:
-		A tuple of: a boolean value indicating if the goal was found 
-		and a list of nodes on the path between start and goal.
-		(goal_found, path)
+		A SearchResult. It unpacks as a tuple of: a boolean value indicating 
+		if the goal was found and a list of nodes on the path between start 
+		and goal, i.e. goal_found, path = block_a_star(...)
 	"""
-	# a dict that will hold the state during the algorithm's run
-	state = AttrDict({
-		'Map': Map,
-		'start': start,
-		'goal': goal,
+	state = new_state(lddb, pathsdb, Map, queue=queue, model=model)
+	return search(state, start, goal, h, bound, with_paths, precheck)
+
+
+def block_distance(lddb, Map, start, goal, h, bound=np.inf, model=FOUR_CONNECTED):
+	"""Length of the shortest path from start to goal, inf if there is none 
+	or if it is longer than `bound`. Runs block_a_star without tracking 
+	parents, after checking that start and goal are connected."""
+	return block_a_star(lddb, None, Map, start, goal, h, bound=bound, with_paths=False, precheck=True, model=model).length
+
+
+def new_state(lddb, pathsdb, Map, block_neighbors=None, egress_mask=None, queue=PriorityQueue, model=FOUR_CONNECTED):
+	"""Create the state dict that holds the state during the algorithm's run.
+	A state can be reused for any number of searches on the same map.
 
+	Blocks and nodes are identified by integers. The block at address (y, x) 
+	of the BlockMap has id y * Map.w + x, and the node at local address (y, x) 
+	in a block is its cell y * block_size + x. Node values are kept in flat 
+	preallocated arrays indexed by block id * block_size**2 + cell. A block's 
+	values are reset the first time it is touched in a search (see touch), 
+	so resetting the whole state between searches takes constant time.
+
+	Args:
+		lddb: local distance database
+		pathsdb: local paths database
+		Map: a BlockMap representing the map to be searched
+		block_neighbors: function (state, block) returning the ids and 
+			sides of the neighbors of a block, as get_block_neighbors
+		egress_mask: function (state, curr_block, next_block, side) 
+			returning the mask of the valid egress nodes on a side of 
+			curr_block, as get_egress_mask
+		queue: class of the open list, see PriorityQueue
+		model: movement model, see block_a_star
+	"""
+	b = Map.block_size
+	n_cells = b * b
+	n_blocks = Map.h * Map.w
+	if not hasattr(lddb, 'table'):
+		# list of dicts, as returned by make_lddb(dense=False)
+		lddb = DictLDDB(lddb, b)
+
+	nodes, slot = boundary_slots(b)
+	# slot_index[c] = slot of cell c, or len(nodes) if c is not a boundary node
+	slot_index = np.array([slot[y][x] if slot[y][x] >= 0 else len(nodes) for y in range(b) for x in range(b)])
+
+	if model.diagonal:
+		# the valid moves out of a block are found by get_model_egress_mask
+		pairs = model.side_pairs(b)
+		cells = [[(e, e_nb) for e, e_nb, _, _ in side] for side in pairs]
+		costs = [[cost for _, _, cost, _ in side] for side in pairs]
+		required = [[r for _, _, _, r in side] for side in pairs]
+	else:
+		cells = [side_cells(b)[d] for d in DIRECTIONS]
+		costs = [[1] * b for _ in DIRECTIONS]
+		required = None
+
+	return AttrDict({
+		'Map': Map,
 		'lddb': lddb,
 		'pathsdb': pathsdb,
-		'h': lambda block, node: h(to_global_node(block, node), goal),
-
-		'g': defaultdict(dict),
-		'g_changed': defaultdict(dict),
-		'heapvalue': {},
-		'heap': PriorityQueue(),
-		'parent': {}
+		'block_size': b,
+		'n_cells': n_cells,
+		'slot_index': slot_index,
+		'model': model,
+		# offsets of the neighbor blocks, indexed by side
+		'block_sides': model.block_sides,
+		# side_cells[d][k] = (cell, neighbor cell) of bit k of the egress masks 
+		# of side d, side_costs[d][k] = cost of that move and, for models with 
+		# diagonal moves, side_required[d][k] = the cells it needs free (see 
+		# Movement.MovementModel.side_pairs)
+		'side_cells': cells,
+		'side_costs': costs,
+		'side_required': required,
+		'block_neighbors': block_neighbors or get_block_neighbors,
+		'egress_mask': egress_mask or (get_model_egress_mask if model.diagonal else get_egress_mask),
+
+		'start': None,
+		'goal': None,
+		'start_block': None,
+		'start_block_node': None,
+		'goal_block': None,
+		'goal_block_node': None,
+		'h': None,
+		# h_block(block) = h values of all cells of block, in one call, if h 
+		# has a batch form (see common.l1_dist); see touch
+		'h_block': None,
+		# local addresses of the cells of a block
+		'cell_ys': np.arange(n_cells) // b,
+		'cell_xs': np.arange(n_cells) % b,
+		# length of the best path found so far
+		'length': np.inf,
+		# max length of the paths searched for (see start_search), and whether 
+		# parents are tracked
+		'bound': np.inf,
+		'with_paths': True,
+		# query-local distances and paths from/to the start and goal nodes, 
+		# keyed by the ids of their blocks. Consulted before lddb and pathsdb, 
+		# which are never written to.
+		'overlay_dists': {},
+		'overlay_paths': defaultdict(dict),
+
+		'g': np.empty(n_blocks * n_cells),
+		'g_changed': np.empty(n_blocks * n_cells, dtype=bool),
+		'parent': np.empty(n_blocks * n_cells, dtype=np.int64),
+		'hval': np.empty(n_blocks * n_cells),
+		'heapvalue': np.empty(n_blocks),
+		# stamp[block] == generation iff block has been touched in the current search
+		'stamp': np.zeros(n_blocks, dtype=np.int64),
+		'generation': 0,
+		'queue': queue,
+		'heap': queue(),
+		'stats': AttrDict()
 	})
 
+
+def reset_state(state):
+	"""Clear the per-query parts of `state`"""
+	for k in ('overlay_dists', 'overlay_paths', 'stats'):
+		state[k].clear()
+	state.generation += 1
+	state.heap = state.queue()
+	state.length = np.inf
+
+
+def touch(state, block):
+	"""Reset the values of `block` if it has not been touched in the current search"""
+	if state.stamp[block] != state.generation:
+		state.stamp[block] = state.generation
+		lo = block * state.n_cells
+		hi = lo + state.n_cells
+		state.g[lo:hi] = np.inf
+		state.g_changed[lo:hi] = False
+		state.parent[lo:hi] = -1
+		state.heapvalue[block] = np.inf
+		if state.h_block is not None:
+			state.hval[lo:hi] = state.h_block(block)
+
+
+def search(state, start, goal, h, bound=np.inf, with_paths=True, precheck=False):
+	"""Run Block A* from start to goal. See block_a_star.
+
+	Args:
+		state: a state dict created by new_state. It is reset before the search.
+		start: global address of the start node
+		goal: global address of the goal node
+		h: heuristic function
+		bound, with_paths, precheck: see block_a_star
+
+	Returns:
+		A SearchResult, as block_a_star. After the search, state.stats holds
+		the number of expanded blocks and the path length.
+	"""
+	start_search(state, start, goal, h, bound, with_paths, precheck)
+	return continue_search(state)
+
+
+def start_search(state, start, goal, h, bound=np.inf, with_paths=True, precheck=False):
+	"""Reset `state` and set it up for a search from start to goal. 
+	If the goal can be ruled out without searching, nothing is pushed on 
+	the heap and continue_search fails at once."""
+	reset_state(state)
+	state.start, state.goal = start, goal
+	state.h = lambda block, cell: h(to_global_node(state, block, divmod(cell, state.block_size)), goal)
+	batch = getattr(h, 'batch', None)
+	state.h_block = None if batch is None else lambda block: batch(*block_cells(state, block), goal)
+	if state.model.dist_dtype is not None and bound < np.inf:
+		# with non-integer move costs, g values and heuristic values are sums 
+		# of floats in different orders, so a path of length `bound` may be 
+		# computed a rounding error above it
+		bound += BOUND_TOLERANCE * max(1., abs(bound))
+	state.bound = bound
+	state.with_paths = with_paths
+
 	# *_block_node = local address within corresponding block
-	start_block, start_block_node = Map.get_node_block(start)
-	goal_block , goal_block_node  = Map.get_node_block(goal)
+	state.start_block, state.start_block_node = node_block(state, start)
+	state.goal_block , state.goal_block_node  = node_block(state, goal)
+
+	if h(start, goal) > bound:
+		return
+	Map = state.Map
+	if precheck and Map._map[start] == 0 and Map._map[goal] == 0 and not Map.connected(start, goal):
+		return
 
-	init(state, start_block, start_block_node)
-	init(state, goal_block, goal_block_node)
+	touch(state, state.start_block)
+	touch(state, state.goal_block)
+	init(state, state.start_block, state.start_block_node)
+	init(state, state.goal_block, state.goal_block_node)
 
-	state.g[start_block][start_block_node] = 0
-	state.g_changed[start_block][start_block_node] = True
-	state.parent[(start_block, start_block_node)] = (None, None)
+	start_id = node_id(state, state.start_block, state.start_block_node)
+	state.g[start_id] = 0
+	state.g_changed[start_id] = True
 
-	state.heap.push(start_block, 0)
-	state.heapvalue[start_block] = 0
+	state.heap.push(state.start_block, 0)
+	state.heapvalue[state.start_block] = 0
 
-	length = np.inf
-	while not state.heap.empty() and state.heapvalue[state.heap.top()[0]] < length:
 
+def continue_search(state):
+	"""Run the main loop of Block A* on a state set up by start_search, until 
+	the heap is empty or no block on it can lead to a shorter path.
+
+	Returns:
+		A SearchResult, as search
+	"""
+	n_cells = state.n_cells
+	goal_block = state.goal_block
+	goal_cell = node_cell(state, state.goal_block_node)
+	length = state.length
+	bound = state.bound
+	costs = state.Map.costs
+	expansions = 0
+	while not state.heap.empty() and state.heap.top()[1] < length:
+
+		if state.heap.top()[1] > bound:
+			# every path within the bound has been found
+			break
 		curr_block = state.heap.pop()
+		state.heapvalue[curr_block] = np.inf
 		ingress_nodes = get_ingress_nodes(state, curr_block)
 		
 		if len(ingress_nodes) == 0:
@@ -94,26 +297,123 @@ def block_a_star(lddb, pathsdb, Map, start, goal, h):
 		
 		if curr_block == goal_block:
 
-			block_lddb = state.lddb[curr_block.idx]
-			dists_to_goal = [
-				state.g[curr_block][y] + block_lddb.get((y, goal_block_node), np.inf) for y in ingress_nodes
-			]
-			
-			new_length = min(length, np.min(dists_to_goal))
+			dists_to_goal = (
+				state.g[curr_block * n_cells + ingress_nodes] + 
+				block_dists(state, curr_block)[ingress_nodes, goal_cell] * costs.item(curr_block)
+			)
+			nearest = np.argmin(dists_to_goal)
 
-			if new_length < length:
-				length = new_length
-				nearest_ingress_node = ingress_nodes[np.argmin(dists_to_goal)]
+			if dists_to_goal[nearest] < length:
+				length = float(dists_to_goal[nearest])
+				nearest_ingress_node = ingress_nodes[nearest]
 				# set parent of goal node, but avoid pointing to self
-				if goal_block_node != nearest_ingress_node:
-					state.parent[(goal_block, goal_block_node)] = (curr_block, nearest_ingress_node)
+				if state.with_paths and goal_cell != nearest_ingress_node:
+					state.parent[goal_block * n_cells + goal_cell] = curr_block * n_cells + nearest_ingress_node
 
 		expand_block(state, curr_block, ingress_nodes)
-
-	if length < np.inf:
-		return True, recover_path(state, goal_block, goal_block_node)
-	else:
-		return False, []
+		expansions += 1
+
+	if length > bound:
+		length = np.inf
+	state.length = length
+	state.stats.expansions = expansions
+	state.stats.length = length
+	return SearchResult(state)
+
+
+class SearchResult(object):
+	def __init__(self, state):
+		"""Result of a Block A* search on `state`.
+
+		Only the chain of parent pointers from goal back to start is copied 
+		out of the state, so creating a result costs a step per block on the 
+		path. The cells of the path are produced lazily by cells(), in order 
+		from start to goal, expanding in-block segments from the paths 
+		database as they are reached. The result stays valid after the state 
+		is reused for another search.
+
+		For compatibility with the tuples returned by earlier versions, a 
+		result unpacks as (goal_found, path):
+			goal_found, path = block_a_star(...)
+
+		Attributes:
+			goal_found: True if a path was found
+			length: length of the path, inf if none was found
+			waypoint_blocks: map addresses of the blocks the path passes 
+				through, from start to goal. None if the search did not 
+				track parents (with_paths=False).
+			stats: copy of state.stats
+		"""
+		super(SearchResult, self).__init__()
+		self.length = state.length
+		self.goal_found = self.length < np.inf
+		self.stats = AttrDict(state.stats)
+		self._block_size = state.block_size
+		self._map_w = state.Map.w
+		self._block_map = state.Map
+
+		# (block, cell) of the waypoints: the nodes on the chain of parents from 
+		# start to goal, and for each waypoint after the first, the paths row 
+		# of its block if its parent is in the same block, else None
+		self._waypoints = []
+		self._rows = []
+		if not state.with_paths:
+			self._waypoints = self.waypoint_blocks = None
+			return
+		if not self.goal_found:
+			self.waypoint_blocks = []
+			return
+		n_cells = state.n_cells
+		curr = node_id(state, state.goal_block, state.goal_block_node)
+		while True:
+			block, cell = divmod(curr, n_cells)
+			self._waypoints.append((block, cell))
+			p_id = int(state.parent[curr])
+			if p_id < 0:
+				break
+			p_block = p_id // n_cells
+			self._rows.append(block_paths(state, block) if p_block == block else None)
+			curr = p_id
+		self._waypoints.reverse()
+		self._rows.reverse()
+
+		self.waypoint_blocks = []
+		for block, _ in self._waypoints:
+			addr = divmod(block, self._map_w)
+			if not self.waypoint_blocks or self.waypoint_blocks[-1] != addr:
+				self.waypoint_blocks.append(addr)
+
+	def cells(self):
+		"""Generate the global addresses of the nodes on the path, from start to goal"""
+		if self._waypoints is None:
+			raise ValueError('the path is not available, the search was run with with_paths=False')
+		b = self._block_size
+		to_global = lambda block, node: _global_node(block, node, b, self._map_w)
+		if not self._waypoints:
+			return
+		block, cell = self._waypoints[0]
+		yield to_global(block, divmod(cell, b))
+		for (p_block, p_cell), (block, cell), row in zip(self._waypoints, self._waypoints[1:], self._rows):
+			if row is None:
+				yield to_global(block, divmod(cell, b))
+				continue
+			# paths are looked up from the child, whose node is a boundary node or start or goal
+			segment = row[(divmod(cell, b), divmod(p_cell, b))]
+			for node in reversed(segment[:-1]):
+				yield to_global(block, node)
+
+	@property
+	def path(self):
+		"""List of the nodes on the path from start to goal, empty if none was found"""
+		return list(self.cells())
+
+	def any_angle_path(self):
+		"""Waypoints of the path smoothed into an any-angle path, with line 
+		of sight checked on the map as it is now. See AnyAngle.smooth_path."""
+		return smooth_path(self._block_map, self.path)
+
+	def __iter__(self):
+		return iter((self.goal_found, self.path))
 
 
 # As descibed in the paper:
@@ -148,146 +448,268 @@ def expand_block(state, curr_block, ingress_nodes):
 	In Twenty-Fifth AAAI Conference on Artificial Intelligence.
 
 	Args:
-		state: state dict. Must contain g, h, g_changed, lddb, parent, heap, heapvalue.
-		curr_block: block to be expanded
-		ingress_nodes: valid ingress nodes in the current block
+		state: state dict, see new_state
+		curr_block: id of the block to be expanded
+		ingress_nodes: array of the cells of the valid ingress nodes in the current block
 	"""
-	g, g_changed, lddb = state.g, state.g_changed, state.lddb
+	g, g_changed, parent, heapvalue = state.g, state.g_changed, state.parent, state.heapvalue
+	n_cells = state.n_cells
+	with_paths, bound = state.with_paths, state.bound
+	# the h values of touched blocks are precomputed if h has a batch form
+	hval = state.hval
+	h = state.h if state.h_block is None else None
+	costs = state.Map.costs
+	lo = curr_block * n_cells
+
+	# the ingress nodes are being expanded
+	ingress_ids = lo + ingress_nodes
+	g_changed[ingress_ids] = False
+	# local distances scaled by the cost multiplier of the block
+	dists = block_dists(state, curr_block)[ingress_nodes]
+	cost = costs.item(curr_block)
+	if cost != 1:
+		dists = dists * cost
+	# best g value of every cell through the ingress nodes, and the ingress 
+	# node it is reached from, computed once per expansion
+	new_g, nearest = min_plus(g[ingress_ids], dists)
+	new_g, new_parent = new_g.tolist(), ingress_ids[nearest].tolist()
 
-	# neighboring blocks
-	nbs = state.Map.block_neighbors(curr_block)
 	# for each neighboring block, next_block
-	for next_block, direction in nbs:
+	for next_block, side in state.block_neighbors(state, curr_block):
 		# get valid egress nodes on that side
-		egress_nodes = get_egress_nodes(state, curr_block, next_block, direction)
-		if len(egress_nodes) == 0:
+		mask = state.egress_mask(state, curr_block, next_block, side)
+		if not mask:
 			continue
+		cells = state.side_cells[side]
+		steps = state.side_costs[side]
+		next_cost = costs.item(next_block)
+		touch(state, next_block)
+		next_lo = next_block * n_cells
+		new_priority = np.inf
 		# for each valid egress node, e, and its neighbor in next_block, e_nb
-		for e, e_nb in egress_nodes:
-
-			e_old_g = state.g[curr_block].get(e, np.inf)
+		while mask:
+			low = mask & -mask
+			mask ^= low
+			k = low.bit_length() - 1
+			e, e_nb = cells[k]
+			e_id, e_nb_id = lo + e, next_lo + e_nb
 
-			# g values for x through each ingress cell
-			gs_to_e = [
-				g[curr_block][y] + lddb[curr_block.idx].get((y, e), np.inf) for y in ingress_nodes
-			]
-			# best (min) g value
-			e_new_g = min(gs_to_e)
-
-			g[curr_block][e] = min(e_old_g, e_new_g)
-			g_changed[curr_block][e] = False
+			# best (min) g value for e through the ingress nodes
+			e_new_g = new_g[e]
 
+			e_g = g[e_id]
 			# if g value has changed, set that ingress node as e's parent
-			if e_new_g < e_old_g:
-				nearest_ingress_node = ingress_nodes[np.argmin(gs_to_e)]
-				state.parent[(curr_block, e)] = (curr_block, nearest_ingress_node)
-
-			e_nb_old_g = g[next_block].get(e_nb, np.inf)
-			e_nb_new_g = g[curr_block][e] + 1
-			
-			g[next_block][e_nb] = min(e_nb_old_g, e_nb_new_g)
+			if e_new_g < e_g:
+				e_g = g[e_id] = e_new_g
+				if with_paths:
+					parent[e_id] = new_parent[e]
+			g_changed[e_id] = False
+
+			# moving into e_nb costs the move's cost times next_block's multiplier
+			e_nb_new_g = e_g + steps[k] * next_cost
 			# if g value has changed, 
-			if e_nb_new_g < e_nb_old_g:
+			if e_nb_new_g < g[e_nb_id]:
+				g[e_nb_id] = e_nb_new_g
 				# set e as e_nb's parent 
-				state.parent[(next_block, e_nb)] = (curr_block, e)
+				if with_paths:
+					parent[e_nb_id] = e_id
 				# and mark e_nb as a possible ingress node for next_block
-				g_changed[next_block][e_nb] = True
-
-		# g + h values for next_block via each possible egress node
-		dists_to_next_block = [
-			g[next_block][e_nb] + state.h(next_block, e_nb) for _, e_nb in egress_nodes
-		]
-		# best g + h
-		new_priority = min(dists_to_next_block)
-		# if improved, push next_block on to the heap
-		if new_priority < state.heapvalue.get(next_block, np.inf) or any(g_changed[next_block].get(e_nb, False) for _, e_nb in egress_nodes):
-			state.heapvalue[next_block] = new_priority
+				g_changed[e_nb_id] = True
+				new_priority = min(new_priority, e_nb_new_g + (hval.item(e_nb_id) if h is None else h(next_block, e_nb)))
+
+		# if improved, push next_block on to the heap, unless it can only 
+		# lead to paths longer than the bound
+		if new_priority < heapvalue[next_block] and new_priority <= bound:
+			heapvalue[next_block] = new_priority
 			state.heap.push(next_block, new_priority)
-			e, x_nb = egress_nodes[np.argmin(dists_to_next_block)]
 
 
 
 ###############################################################################################
 # Helpers
 ###############################################################################################
-def init(state, block, node):
-	"""Set distances and paths from `node` to every other node (and vice versa) in `block`.
+def min_plus(g_ys, dists):
+	"""Min-plus product of the g values of the ingress nodes and their distances 
+	to the other cells of the block.
 
 	Args:
-		state: state dict. Must contain lddb and pathsdb.
-		block: block containing the node
-		node: target node
+		g_ys: array of the g values of the ingress nodes, of shape (|Y|,)
+		dists: array of the distances from the ingress nodes, of shape (|Y|, n_cells)
+
+	Returns:
+		A tuple of: the array of min_y (g_ys[y] + dists[y, x]) for every cell x, 
+		and the array of the index y of the ingress node attaining each minimum.
 	"""
-	dists, parent_map = bfs_to_all_points(block, node)
-	for k, v in dists.items():
-		state.lddb[block.idx][(node, k)] = v
-		state.lddb[block.idx][(k, node)] = v
-		p = get_path_from_parent_map(parent_map, k)
-		state.pathsdb[block.idx][(node, k)] = p
-		state.pathsdb[block.idx][(k, node)] = p[::-1]
+	candidates = g_ys[:, None] + dists
+	nearest = candidates.argmin(axis=0)
+	return candidates[nearest, np.arange(candidates.shape[1])], nearest
 
 
-def get_egress_nodes(state, curr_block, next_block, direction):
-	"""Get valid egress nodes on the side of `curr_block` represented by `direction`.
-	`next_block` is assumed to be in the direction `direction` of `curr_block`.
+def init(state, block, node):
+	"""Set distances and paths from `node` to every other node (and vice versa) in `block`
+	in the query-local overlay.
 
 	Args:
-		state: the real part (default 0.0)
-		curr_block: block whose egress nodes are sought
-		next_block: block on the side of `curr_block` represented by `direction`
-		direction: a tuple representing direction e.g (1, 0) = UP, (0, 1) = RIGHT etc.
-
-	Returns:
-		list of tuples of the form (egress_node, egress_node_neighbor)
+		state: state dict. Must contain overlay_dists and overlay_paths.
+		block: id of the block containing the node
+		node: local address of the target node
 	"""
-	dy, dx = direction
-	boundary = visitable(curr_block, boundary_nodes(curr_block))
-	sz = len(curr_block)
-	if dy == 0:
-		x = 0 if dx == -1 else len(curr_block) - 1
-		next_x = (x + dx) % sz
-		egress = [b for b in boundary if b[1] == x]
-		egress_nghb = [(by, next_x) for by, bx in boundary if ((bx + dx) % sz) == next_x]
-	else:
-		y = 0 if dy == -1 else len(curr_block) - 1
-		next_y = (y + dy) % sz
-		egress = [b for b in boundary if b[0] == y]
-		egress_nghb = [(next_y, bx) for by, bx in boundary if ((by + dy) % sz) == next_y]
-	return [(e, en) for e, en in zip(egress, egress_nghb) if is_visitable(next_block, en)]
+	c = node_cell(state, node)
+	dists, parents = local_search(block_idx(state, block), state.block_size, c, state.model)
+	overlay_dists = state.overlay_dists.get(block)
+	if overlay_dists is None:
+		overlay_dists = state.overlay_dists[block] = block_dists(state, block)
+	dists = np.array(dists, dtype=float)
+	reached = dists >= 0
+	overlay_dists[c, reached] = dists[reached]
+	overlay_dists[reached, c] = dists[reached]
+	# paths from and to `node` are read off the BFS tree when needed
+	state.overlay_paths[block][c] = parents
+
+
+class _OverlayRow(object):
+	"""Query-local paths of a block, backed by the block's row in the shared database.
+	`trees` maps the cells of start and goal to the parent cells of their BFS trees."""
+	def __init__(self, trees, base, block_size):
+		self.trees = trees
+		self.base = base
+		self.block_size = block_size
+
+	def get(self, key, default=None):
+		b = self.block_size
+		(y1, x1), (y2, x2) = key
+		c1, c2 = y1 * b + x1, y2 * b + x2
+		if c1 in self.trees:
+			path = self._walk(self.trees[c1], c2, c1)
+			if path is not None:
+				return path[::-1]
+		if c2 in self.trees:
+			path = self._walk(self.trees[c2], c1, c2)
+			if path is not None:
+				return path
+		return self.base.get(key, default)
+
+	def _walk(self, parents, c, root):
+		"""Nodes from c up to the root of the tree, None if c is not in the tree"""
+		if c != root and parents[c] < 0:
+			return None
+		path = [divmod(c, self.block_size)]
+		while parents[c] >= 0:
+			c = parents[c]
+			path.append(divmod(c, self.block_size))
+		return path
+
+	def __getitem__(self, key):
+		v = self.get(key)
+		if v is None:
+			raise KeyError(key)
+		return v
+
+
+def block_dists(state, block):
+	"""Distances between the cells of `block`, including the query-local ones, 
+	as a float array of shape (n_cells, n_cells). Entries between non-boundary 
+	cells other than start and goal are inf."""
+	overlay = state.overlay_dists.get(block)
+	if overlay is not None:
+		return overlay
+	table = state.lddb.table(block_idx(state, block))
+	n = len(table)
+	padded = np.full((n + 1, n + 1), np.inf)
+	padded[:n, :n] = table
+	return padded[np.ix_(state.slot_index, state.slot_index)]
+
+
+def block_paths(state, block):
+	"""Paths within `block`, including the query-local ones"""
+	base = state.pathsdb[block_idx(state, block)]
+	entries = state.overlay_paths.get(block)
+	return base if entries is None else _OverlayRow(entries, base, state.block_size)
+
+
+def block_idx(state, block):
+	"""Index (see Block) of the block with id `block`"""
+	return int(state.Map.idxs.flat[block])
+
+
+def block_cells(state, block):
+	"""Global addresses of the cells of `block`, as a pair of arrays (ys, xs)"""
+	by, bx = divmod(block, state.Map.w)
+	b = state.block_size
+	return by * b + state.cell_ys, bx * b + state.cell_xs
+
+
+def get_block_neighbors(state, block):
+	"""Ids of the blocks adjacent to `block`, with the side of `block` they 
+	are on, as an index into state.block_sides (Block.DIRECTIONS, followed by 
+	Block.CORNERS for movement models with diagonal moves)"""
+	Map = state.Map
+	y, x = divmod(block, Map.w)
+	return [
+		((y + dy) * Map.w + x + dx, d) 
+		for d, (dy, dx) in enumerate(state.block_sides) if Map._is_valid(y + dy, x + dx)
+	]
+
+
+def get_egress_mask(state, curr_block, next_block, side):
+	"""Mask of the valid egress nodes on side `side` of `curr_block`, 
+	precomputed by the BlockMap. Bit k refers to the pair state.side_cells[side][k]."""
+	return state.Map.egress.item(curr_block * 4 + side)
+
+
+def get_model_egress_mask(state, curr_block, next_block, side):
+	"""Mask of the valid moves from `curr_block` to the neighbor block on 
+	side `side`, for movement models with diagonal moves. Computed from the 
+	indices of the blocks around `curr_block`; bit k refers to 
+	state.side_cells[side][k]."""
+	Map = state.Map
+	by, bx = divmod(curr_block, Map.w)
+	# free cells of the blocks around curr_block by offset, 0 outside the map
+	free = {}
+	mask = 0
+	for k, required in enumerate(state.side_required[side]):
+		for offset, cells in required:
+			f = free.get(offset)
+			if f is None:
+				y, x = by + offset[0], bx + offset[1]
+				f = free[offset] = ~int(Map.idxs[y, x]) if Map._is_valid(y, x) else 0
+			if f & cells != cells:
+				break
+		else:
+			mask |= 1 << k
+	return mask
 
 
 def get_ingress_nodes(state, block):
-	"""Get nodes in block whose g values have changed since last expansion"""
-	block_g = state.g[block]
-	block_g_flag = state.g_changed[block]
-	return [node for node in block_g.keys() if block_g_flag.get(node, False)]
+	"""Get cells of block whose g values have changed since last expansion"""
+	lo = block * state.n_cells
+	return np.flatnonzero(state.g_changed[lo: lo + state.n_cells])
 
 
-def to_global_node(block, node):
-	"""Convert to global node address"""
-	by, bx = block.map_addr
-	sz = block.size
+def node_block(state, node):
+	"""Id of the block containing the global node `node` and the node's local address"""
 	y, x = node
-	return (by * sz + y), (bx * sz + x)
+	b = state.block_size
+	return (y // b) * state.Map.w + (x // b), (y % b, x % b)
 
-def recover_path(state, goal_block, goal_block_node):
-	"""Extract path from start to goal from the parent mappings"""
-	path = [to_global_node(goal_block, goal_block_node)]
-	curr_block, curr_node = goal_block, goal_block_node
-	while True:
-		p_block, p_node = state.parent[(curr_block, curr_node)]
 
-		if p_block is None:
-			break
+def node_cell(state, node):
+	"""Cell of local node address `node`"""
+	y, x = node
+	return y * state.block_size + x
 
-		if p_block == curr_block:
-			in_block_path = state.pathsdb[curr_block.idx][(curr_node, p_node)][1:]
-			path.extend([to_global_node(curr_block, n) for n in in_block_path])
-		else:
-			path.append(to_global_node(p_block, p_node))
 
-		curr_block, curr_node = p_block, p_node
-	return path[::-1]
+def node_id(state, block, node):
+	"""Id of the node with local address `node` in `block`"""
+	return block * state.n_cells + node_cell(state, node)
 
 
+def to_global_node(state, block, node):
+	"""Convert to global node address"""
+	return _global_node(block, node, state.block_size, state.Map.w)
+
 
+def _global_node(block, node, block_size, map_w):
+	by, bx = divmod(block, map_w)
+	y, x = node
+	return (by * block_size + y), (bx * block_size + x)
@@ -0,0 +1,276 @@
+from collections import deque
+
+from Block import DIRECTIONS, block_components, side_cells
+from common import label_components
+
+
+class ConnectivityIndex(object):
+	def __init__(self, block_map, search_limit=10000):
+		"""Index of the connected components of the free cells of a BlockMap,
+		for answering "is there any path from a to b" without searching.
+
+		The index is built by labeling the components of the whole map (see
+		common.label_components). After that it is kept up to date block by
+		block through the BlockMap's listeners: each changed block is split
+		into its own components (see Block.block_components), which are linked
+		to the components they touch, inside the block and across its sides
+		through the egress masks of the BlockMap, in a union-find structure.
+
+		Freeing cells only ever merges components. Blocking cells can split a
+		component, which a union-find cannot undo, so a search is run from the
+		free neighbors of the blocked cells within their components (see
+		_split), and the parts split off are given new nodes. Only when this
+		search visits more than search_limit cells is the index rebuilt, on
+		the next lookup.
+
+		Args:
+			block_map: the BlockMap to index
+			search_limit: number of cells the search after blocking cells may
+				visit before the index is rebuilt instead
+		"""
+		super(ConnectivityIndex, self).__init__()
+		self.block_map = block_map
+		self.search_limit = search_limit
+		self.rebuilds = 0
+		self._dirty = True
+		self._listener = self._update
+		block_map.add_listener(self._listener)
+
+	def close(self):
+		"""Stop tracking the changes of the map. The index must not be used after this."""
+		if self._listener is not None:
+			self.block_map.remove_listener(self._listener)
+			self._listener = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def _build(self):
+		Map = self.block_map._map
+		# label of each cell from the last full build, -1 for obstacles
+		self._labels = label_components(Map)
+		# block indices as of the last update of the index
+		self._idxs = self.block_map.idxs.copy()
+		# map address -> list of (component, node) of the blocks changed since
+		# the last build. Components are encoded like block indices.
+		self._local = {}
+		# union-find parents of merged nodes. Nodes are the labels of the last
+		# build and the ids given to components of changed blocks.
+		self._parent = {}
+		self._next_node = Map.size
+		self._dirty = False
+		self.rebuilds += 1
+
+	def connected(self, node1, node2):
+		"""True if there is a path between the cells node1 and node2"""
+		c1 = self.component(node1)
+		return c1 is not None and c1 == self.component(node2)
+
+	def component(self, node):
+		"""Id of the component of cell `node`, None if it is an obstacle. Ids
+		are only comparable until the next update of the map."""
+		if self._dirty:
+			self._build()
+		n = self._node(*node)
+		return None if n is None else self._find(n)
+
+	def _node(self, y, x):
+		"""Union-find node of cell (y, x), None if it is an obstacle"""
+		b = self.block_map.block_size
+		local = self._local.get((y // b, x // b))
+		if local is None:
+			label = self._labels[y, x]
+			return None if label < 0 else int(label)
+		bit = 1 << ((y % b) * b + x % b)
+		for component, n in local:
+			if component & bit:
+				return n
+		return None
+
+	def _components(self, addr, idx):
+		"""(component, node) pairs of the block at `addr` with index `idx`, as currently indexed"""
+		local = self._local.get(addr)
+		if local is not None:
+			return local
+		b = self.block_map.block_size
+		y, x = addr
+		out = []
+		for component in block_components(idx, b):
+			cell = (component & -component).bit_length() - 1
+			out.append((component, int(self._labels[y * b + cell // b, x * b + cell % b])))
+		return out
+
+	def _find(self, n):
+		parent = self._parent
+		root = n
+		while root in parent:
+			root = parent[root]
+		while n != root:
+			parent[n], n = root, parent[n]
+		return root
+
+	def _union(self, n1, n2):
+		r1, r2 = self._find(n1), self._find(n2)
+		if r1 != r2:
+			self._parent[max(r1, r2)] = min(r1, r2)
+
+	def _update(self, changed):
+		"""BlockMap listener"""
+		if self._dirty:
+			return
+		bm = self.block_map
+		b = bm.block_size
+		# components of the changed blocks before the update
+		old = {addr: self._components(addr, int(self._idxs[addr])) for addr in changed}
+		seeds = set()
+		for addr in changed:
+			old_idx, new_idx = int(self._idxs[addr]), int(bm.idxs[addr])
+			self._idxs[addr] = new_idx
+			local = []
+			for component in block_components(new_idx, b):
+				n = self._next_node
+				self._next_node += 1
+				for c, old_n in old[addr]:
+					if c & component:
+						self._union(n, old_n)
+				local.append((component, n))
+			self._local[addr] = local
+			seeds.update(self._free_neighbors(addr, new_idx & ~old_idx))
+		for addr in changed:
+			self._link(addr)
+		# every part of a component split by the blocked cells holds a free
+		# neighbor of one of them
+		if len(seeds) > 1 and not self._split(sorted(seeds)):
+			self._dirty = True
+
+	def _link(self, addr):
+		"""Link the components of the block at `addr` to those of its neighbor
+		blocks across the valid egress nodes"""
+		bm = self.block_map
+		b = bm.block_size
+		y, x = addr
+		local = self._local[addr]
+		for d, direction in enumerate(DIRECTIONS):
+			mask = int(bm.egress[y, x, d])
+			cells = side_cells(b)[direction]
+			ny, nx = y + direction[0], x + direction[1]
+			while mask:
+				low = mask & -mask
+				mask ^= low
+				e, e_nb = cells[low.bit_length() - 1]
+				nb = self._node(ny * b + e_nb // b, nx * b + e_nb % b)
+				if nb is not None:
+					self._union(next(n for c, n in local if c & (1 << e)), nb)
+
+	def _free_neighbors(self, addr, blocked):
+		"""Flat indices of the free cells of the map next to the `blocked`
+		cells of the block at `addr`"""
+		Map = self.block_map._map
+		h, w = Map.shape
+		b = self.block_map.block_size
+		y0, x0 = addr[0] * b, addr[1] * b
+		out = []
+		while blocked:
+			low = blocked & -blocked
+			blocked ^= low
+			cy, cx = divmod(low.bit_length() - 1, b)
+			for dy, dx in DIRECTIONS:
+				y, x = y0 + cy + dy, x0 + cx + dx
+				if 0 <= y < h and 0 <= x < w and not Map[y, x]:
+					out.append(y * w + x)
+		return out
+
+	def _split(self, seeds):
+		"""Find the parts of the components of the `seeds` and give every part
+		but one of each component a new node.
+
+		A breadth first search is run from each seed, one cell of each search
+		at a time, and searches that meet are merged. A search that runs out
+		of cells has found a whole part. Searching stops when no component has
+		more than one unfinished search left, so a component that is not split
+		costs about as many steps as the distance between its seeds, and a part
+		that is split off costs about its own size.
+
+		Returns:
+			False if more than self.search_limit cells were visited first, in
+			which case nothing is changed and the index has to be rebuilt.
+		"""
+		Map = self.block_map._map
+		h, w = Map.shape
+		# union-find parents of merged searches, the searches are numbered
+		# like the seeds
+		merged = list(range(len(seeds)))
+
+		def find(i):
+			while merged[i] != i:
+				merged[i] = merged[merged[i]]
+				i = merged[i]
+			return i
+
+		search_of = {cell: i for i, cell in enumerate(seeds)}
+		frontiers = [deque([cell]) for cell in seeds]
+		component_of = [self._find(self._node(*divmod(cell, w))) for cell in seeds]
+		# component -> searches of the component that are not finished
+		active = {}
+		for i, component in enumerate(component_of):
+			active.setdefault(component, set()).add(i)
+		finished = []
+		while True:
+			running = [i for searches in active.values() if len(searches) > 1 for i in searches]
+			if not running:
+				break
+			for i in running:
+				i = find(i)
+				component = component_of[i]
+				if len(active[component]) < 2:
+					continue
+				frontier = frontiers[i]
+				if not frontier:
+					active[component].discard(i)
+					finished.append(i)
+					continue
+				y, x = divmod(frontier.popleft(), w)
+				for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+					if not (0 <= ny < h and 0 <= nx < w) or Map[ny, nx]:
+						continue
+					cell = ny * w + nx
+					j = search_of.get(cell)
+					if j is None:
+						search_of[cell] = i
+						frontier.append(cell)
+						continue
+					j = find(j)
+					if j != i:
+						merged[j] = i
+						frontier.extend(frontiers[j])
+						frontiers[j] = None
+						active[component].discard(j)
+				if len(search_of) > self.search_limit:
+					return False
+
+		parts = {i: [] for i in finished}
+		for cell, i in search_of.items():
+			i = find(i)
+			if i in parts:
+				parts[i].append(cell)
+		for cells in parts.values():
+			self._relabel(cells, w)
+		return True
+
+	def _relabel(self, cells, w):
+		"""Give the flat indices `cells` of a whole component a new node"""
+		b = self.block_map.block_size
+		n = self._next_node
+		self._next_node += 1
+		for cell in cells:
+			y, x = divmod(cell, w)
+			addr = (y // b, x // b)
+			local = self._local.get(addr)
+			if local is None:
+				self._labels[y, x] = n
+				continue
+			bit = 1 << ((y % b) * b + x % b)
+			self._local[addr] = [(c, n if c & bit else m) for c, m in local]
@@ -0,0 +1,277 @@
+from collections import defaultdict
+from time import perf_counter
+
+import numpy as np
+from Block_A_star import (
+	SearchResult, new_state, reset_state, search, start_search, continue_search,
+	block_dists, get_block_neighbors, node_block, node_cell
+)
+from Movement import FOUR_CONNECTED
+from PriorityQueue import PriorityQueue
+from common import AttrDict, l1_dist
+
+
+class HierarchicalBlockAStar(object):
+	def __init__(self, block_map, lddb, pathsdb, region_size=8, h=l1_dist, model=FOUR_CONNECTED):
+		"""Block A* with an abstraction layer for long-range queries, in the
+		style of HPA*.
+
+		The blocks of the map are grouped into square regions of
+		region_size x region_size blocks. Every maximal run of free cell pairs
+		across the border of two regions is an entrance, represented by the
+		pair of cells in the middle of the run. These cells are the nodes of an
+		abstract graph. It has an edge across each entrance, of the cost of the
+		step into the cell on the other side, and an edge between every two
+		entrance cells of a region that are connected inside the region, whose
+		length is found by Block A* restricted to the blocks of the region.
+
+		A query links start and goal to the entrances of their regions the same
+		way, searches the abstract graph and then runs Block A* from start to
+		goal restricted to the corridor of regions the abstract path passes
+		through. The cost of a query depends on the path length and the region
+		size, rather than on the size of the map. Paths are valid but may be
+		slightly longer than the shortest one, when it leaves the corridor.
+
+		Regions with blocks changed through BlockMap.set_cells,
+		BlockMap.update_region or BlockMap.set_costs are recomputed before
+		the next query, together with their neighbors, and only the edges of
+		the graph at their entrances are replaced.
+
+		Preprocessing runs one search per entrance cell, inside its region,
+		so its cost grows with the area of the map: about 30 s for a 512 x 512
+		map with 20% obstacles, 4 x 4 blocks and region_size=8, which
+		projects to about 30 minutes at 4096 x 4096.
+
+		Args:
+			block_map: the BlockMap to be searched
+			lddb: local distance database
+			pathsdb: local paths database
+			region_size: side of a region, in blocks
+			h: heuristic function
+			model: movement model of lddb and pathsdb, see block_a_star
+		"""
+		super(HierarchicalBlockAStar, self).__init__()
+		self.block_map = block_map
+		self.region_size = region_size
+		self.h = h
+		self.stats = AttrDict()
+		self.rh = -(-block_map.h // region_size)
+		self.rw = -(-block_map.w // region_size)
+
+		# regions the searches on _state may enter
+		self._allowed = set()
+		self._state = new_state(lddb, pathsdb, block_map, block_neighbors=self._block_neighbors, model=model)
+		# (region, side) -> list of (cell, cell) pairs of the entrances across
+		# the right (side 2) or bottom (side 3) border of region
+		self._entrances = {}
+		# region -> {cell: {cell: distance}} between the entrance cells of region
+		self._intra = {}
+		self._graph = None
+		self._dirty = {(ry, rx) for ry in range(self.rh) for rx in range(self.rw)}
+		self._listener = self._update
+		block_map.add_listener(self._listener)
+		self._refresh()
+
+	def close(self):
+		"""Stop tracking the changes of the map. The object must not be used after this."""
+		if self._listener is not None:
+			self.block_map.remove_listener(self._listener)
+			self._listener = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def _update(self, changed):
+		"""BlockMap listener"""
+		r = self.region_size
+		self._dirty.update((y // r, x // r) for y, x in changed)
+
+	def _block_neighbors(self, state, block):
+		w, r = self.block_map.w, self.region_size
+		allowed = self._allowed
+		return [
+			(nb, d) for nb, d in get_block_neighbors(state, block)
+			if ((nb // w) // r, (nb % w) // r) in allowed
+		]
+
+	def region_of(self, node):
+		"""Region of the global node `node`"""
+		r = self.region_size * self.block_map.block_size
+		return node[0] // r, node[1] // r
+
+	def _refresh(self):
+		"""Recompute the entrances and distances of the changed regions"""
+		if not self._dirty:
+			return
+		dirty, self._dirty = self._dirty, set()
+		borders = set()
+		for ry, rx in dirty:
+			borders.update([((ry, rx), 2), ((ry, rx), 3), ((ry, rx - 1), 2), ((ry - 1, rx), 3)])
+		for region, side in borders:
+			if self._is_region(*region):
+				self._entrances[region, side] = self._find_entrances(region, side)
+
+		affected = set()
+		for ry, rx in dirty:
+			affected.update([(ry, rx), (ry, rx - 1), (ry, rx + 1), (ry - 1, rx), (ry + 1, rx)])
+		affected = {region for region in affected if self._is_region(*region)}
+
+		# drop the edges of the old entrance cells of the affected regions
+		if self._graph is None:
+			self._graph = defaultdict(dict)
+		graph = self._graph
+		for region in affected:
+			for u in self._intra.get(region, ()):
+				for v in graph.pop(u, {}):
+					if v in graph:
+						graph[v].pop(u, None)
+
+		for region in affected:
+			nodes = self._region_nodes(region)
+			self._intra[region] = {u: self._distances(u, nodes, [region]) for u in nodes}
+
+		# add back the edges across all borders of the affected regions, and
+		# inside them
+		for ry, rx in affected:
+			for border, side in [((ry, rx), 2), ((ry, rx), 3), ((ry, rx - 1), 2), ((ry - 1, rx), 3)]:
+				for u, v in self._entrances.get((border, side), []):
+					graph[u][v], graph[v][u] = self._step_cost(v), self._step_cost(u)
+		for region in affected:
+			for u, vs in self._intra[region].items():
+				for v, d in vs.items():
+					if u != v and d < graph[u].get(v, np.inf):
+						graph[u][v] = d
+
+	def _step_cost(self, node):
+		"""Cost of a straight move into the global node `node`"""
+		b = self.block_map.block_size
+		return self.block_map.costs.item(node[0] // b, node[1] // b)
+
+	def _is_region(self, ry, rx):
+		return 0 <= ry < self.rh and 0 <= rx < self.rw
+
+	def _find_entrances(self, region, side):
+		"""Entrances across the right (side 2) or bottom (side 3) border of `region`"""
+		Map = self.block_map
+		r = self.region_size * Map.block_size
+		ry, rx = region
+		if side == 2:
+			if rx + 1 >= self.rw:
+				return []
+			x, lo, hi = (rx + 1) * r - 1, ry * r, min((ry + 1) * r, Map._map.shape[0])
+			free = (Map._map[lo:hi, x] == 0) & (Map._map[lo:hi, x + 1] == 0)
+			pair = lambda i: ((lo + i, x), (lo + i, x + 1))
+		else:
+			if ry + 1 >= self.rh:
+				return []
+			y, lo, hi = (ry + 1) * r - 1, rx * r, min((rx + 1) * r, Map._map.shape[1])
+			free = (Map._map[y, lo:hi] == 0) & (Map._map[y + 1, lo:hi] == 0)
+			pair = lambda i: ((y, lo + i), (y + 1, lo + i))
+		edges = np.diff(np.concatenate(([0], free.astype(np.int8), [0])))
+		starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+		return [pair(int(s + e - 1) // 2) for s, e in zip(starts, ends)]
+
+	def _region_nodes(self, region):
+		"""Entrance cells inside `region`"""
+		ry, rx = region
+		nodes = set()
+		for border, side, i in [((ry, rx), 2, 0), ((ry, rx), 3, 0), ((ry, rx - 1), 2, 1), ((ry - 1, rx), 3, 1)]:
+			nodes.update(pair[i] for pair in self._entrances.get((border, side), []))
+		return sorted(nodes)
+
+	def _distances(self, src, targets, regions):
+		"""Distances from src to each of the boundary cells `targets`,
+		with paths restricted to `regions`, as a dict of the finite ones"""
+		state = self._state
+		self._allowed = set(regions)
+		start_search(state, src, src, lambda node, goal: 0, with_paths=False)
+		# search until the heap is empty
+		state.goal_block = -1
+		continue_search(state)
+
+		n_cells = state.n_cells
+		out = {}
+		for t in targets:
+			block, node = node_block(state, t)
+			if state.stamp[block] != state.generation:
+				continue
+			g = state.g[block * n_cells: (block + 1) * n_cells]
+			dists = block_dists(state, block)[:, node_cell(state, node)] * self.block_map.costs.item(block)
+			d = float(np.min(g + dists))
+			if d < np.inf:
+				out[t] = d
+		return out
+
+	def search(self, start, goal):
+		"""Find a path from start to goal.
+
+		Returns:
+			A SearchResult, as block_a_star. self.stats holds the number of
+			abstract nodes expanded, the number of regions in the corridor and
+			the stats of the refining search.
+		"""
+		t1 = perf_counter()
+		self._refresh()
+		rs, rg = self.region_of(start), self.region_of(goal)
+		s_edges = self._distances(start, self._region_nodes(rs), [rs])
+		g_edges = self._distances(goal, self._region_nodes(rg), [rg])
+		if rs == rg:
+			# the best path may stay inside the region
+			self._allowed = {rs}
+			direct = search(self._state, start, goal, self.h, with_paths=False).length
+			if direct < np.inf:
+				s_edges[goal] = min(direct, s_edges.get(goal, np.inf))
+
+		nodes, expansions = self._abstract_path(start, goal, s_edges, g_edges)
+		self.stats = AttrDict(abstract_expansions=expansions)
+		if nodes is None:
+			state = self._state
+			reset_state(state)
+			state.with_paths = True
+			state.stats.expansions = 0
+			state.stats.length = np.inf
+			result = SearchResult(state)
+		else:
+			self._allowed = {self.region_of(node) for node in nodes}
+			result = search(self._state, start, goal, self.h)
+			self.stats.corridor = len(self._allowed)
+		self.stats.update(result.stats)
+		self.stats.time = perf_counter() - t1
+		return result
+
+	def _abstract_path(self, start, goal, s_edges, g_edges):
+		"""A* on the abstract graph, extended with the edges from start and
+		to goal. Returns the nodes of the path, or None, and the number of
+		expanded nodes."""
+		graph, h = self._graph, self.h
+		g = {start: 0}
+		parent = {}
+		closed = set()
+		heap = PriorityQueue()
+		heap.push(start, h(start, goal))
+		expansions = 0
+		while not heap.empty():
+			u = heap.pop()
+			if u == goal:
+				path = [u]
+				while u in parent:
+					u = parent[u]
+					path.append(u)
+				return path[::-1], expansions
+			closed.add(u)
+			expansions += 1
+			edges = list(graph.get(u, {}).items())
+			if u == start:
+				edges += s_edges.items()
+			if u in g_edges:
+				edges.append((goal, g_edges[u]))
+			for v, d in edges:
+				if v in closed or g[u] + d >= g.get(v, np.inf):
+					continue
+				g[v] = g[u] + d
+				parent[v] = u
+				heap.push(v, g[v] + h(v, goal))
+		return None, expansions
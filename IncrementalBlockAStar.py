@@ -0,0 +1,158 @@
+from collections import defaultdict
+
+import numpy as np
+from Block_A_star import SearchResult, new_state, start_search, continue_search, init, node_id
+from Movement import FOUR_CONNECTED
+from common import AttrDict, l1_dist
+
+
+class IncrementalBlockAStar(object):
+	def __init__(self, block_map, lddb, pathsdb, start, goal, h=l1_dist, model=FOUR_CONNECTED):
+		"""Block A* search from start to goal that is repaired, rather than 
+		rerun, when the map changes.
+
+		The search state (g values, parents and the heap) is kept between calls 
+		to plan. After the map is changed with BlockMap.set_cells or 
+		BlockMap.update_region, only the nodes whose g values depended on a 
+		changed block are reset, the blocks around them are reopened and the 
+		search is continued from there.
+
+		Args:
+			block_map: the BlockMap to be searched
+			lddb: local distance database
+			pathsdb: local paths database
+			start: global address of the start node
+			goal: global address of the goal node
+			h: heuristic function
+			model: movement model of lddb and pathsdb, see block_a_star
+		"""
+		super(IncrementalBlockAStar, self).__init__()
+		self.block_map = block_map
+		self.start = start
+		self.goal = goal
+		self.h = h
+		self.stats = AttrDict()
+
+		self._state = new_state(lddb, pathsdb, block_map, model=model)
+		self._result = None
+		# addresses of blocks changed since the last call to plan
+		self._changed = set()
+		self._listener = self._changed.update
+		block_map.add_listener(self._listener)
+
+	def close(self):
+		"""Stop tracking the changes of the map. The object must not be used after this."""
+		if self._listener is not None:
+			self.block_map.remove_listener(self._listener)
+			self._listener = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def plan(self):
+		"""Find a path from start to goal on the current map.
+
+		Returns:
+			A SearchResult, as block_a_star. self.stats holds the number of 
+			blocks expanded by this call and the path length.
+		"""
+		state = self._state
+		if self._is_blocked(self.start) or self._is_blocked(self.goal):
+			# start over once start and goal are free again
+			self._result = None
+			self._changed.clear()
+			state.length = np.inf
+			state.stats = AttrDict(expansions=0, length=np.inf)
+			self.stats = AttrDict(state.stats)
+			return SearchResult(state)
+
+		if self._result is None:
+			self._changed.clear()
+			start_search(state, self.start, self.goal, self.h)
+			self._result = continue_search(state)
+		elif self._changed:
+			changed = list(self._changed)
+			self._changed.clear()
+			self._repair(changed)
+			self._result = continue_search(state)
+		else:
+			state.stats.expansions = 0
+		self.stats = AttrDict(state.stats)
+		return self._result
+
+	def _is_blocked(self, node):
+		block, block_node = self.block_map.get_node_block(node)
+		return block[block_node] == 1
+
+	def _repair(self, changed):
+		"""Make the search state consistent with the blocks at the map addresses `changed`"""
+		state = self._state
+		g, g_changed, parent = state.g, state.g_changed, state.parent
+		n_cells, w = state.n_cells, self.block_map.w
+		changed = {y * w + x for y, x in changed}
+
+		# the in-block distances and paths of start and goal depend on their blocks
+		endpoints = [(state.start_block, state.start_block_node), (state.goal_block, state.goal_block_node)]
+		for block, _ in endpoints:
+			if block in changed:
+				state.overlay_dists.pop(block, None)
+				state.overlay_paths.pop(block, None)
+		for block, node in endpoints:
+			if block in changed:
+				init(state, block, node)
+
+		# reset the nodes of the changed blocks and all nodes whose path from
+		# start passes through them
+		touched = np.flatnonzero(state.stamp == state.generation)
+		ids = (touched[:, None] * n_cells + np.arange(n_cells)).ravel()
+		has_parent = parent[ids] >= 0
+		children = defaultdict(list)
+		for child, p in zip(ids[has_parent].tolist(), parent[ids[has_parent]].tolist()):
+			children[p].append(child)
+		stack = [
+			block * n_cells + c for block in changed if state.stamp[block] == state.generation
+			for c in np.flatnonzero(g[block * n_cells: (block + 1) * n_cells] < np.inf).tolist()
+		]
+		invalid = set(stack)
+		while stack:
+			for child in children[stack.pop()]:
+				if child not in invalid:
+					invalid.add(child)
+					stack.append(child)
+		invalid = np.array(sorted(invalid), dtype=np.int64)
+		g[invalid] = np.inf
+		g_changed[invalid] = False
+		parent[invalid] = -1
+
+		start_id = node_id(state, state.start_block, state.start_block_node)
+		if g[start_id] == np.inf:
+			g[start_id] = 0
+
+		# reopen the reset region, i.e. re-expand the valid nodes of the blocks 
+		# in and around it, and the goal block, so that the path length is
+		# recomputed
+		region = changed | set((invalid // n_cells).tolist())
+		reopen = set(region) | {state.goal_block}
+		for block in region:
+			reopen.update(nb for nb, _ in state.block_neighbors(state, block))
+		for block in reopen:
+			if state.stamp[block] != state.generation:
+				continue
+			lo = block * n_cells
+			cells = np.flatnonzero(g[lo: lo + n_cells] < np.inf)
+			if len(cells) == 0:
+				continue
+			g_changed[lo + cells] = True
+			if state.h_block is not None:
+				hs = state.hval[lo + cells]
+			else:
+				hs = np.array([state.h(block, c) for c in cells.tolist()])
+			priority = float(np.min(g[lo + cells] + hs))
+			if priority < state.heapvalue[block]:
+				state.heapvalue[block] = priority
+				state.heap.push(block, priority)
+
+		state.length = np.inf
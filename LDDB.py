@@ -1,48 +1,739 @@
-from collections import deque
+from collections import OrderedDict
+from heapq import heappush, heappop
 from Block import *
+from Movement import FOUR_CONNECTED
 from time import perf_counter as timer
+import multiprocessing as mp
+import os
 import pickle
+import shelve
+import struct
 
-from common import get_path_from_parent_map
-from Block import neighbors
+import numpy as np
+
+
+def bfs_cells(idx, size, start):
+	"""Bit-parallel Breadth First Search from cell `start` of the block with 
+	index `idx`. Each layer of the search is a set of cells encoded like a 
+	block index, so it is expanded as a whole with a few shifts and masks 
+	(see Block.expand_bits) and the parents of the cells of the next layer 
+	are found a direction at a time in the same way.
+
+	Returns:
+		A tuple of lists over the size**2 cells of the block: the distance of 
+		each cell from `start` (-1 if unreachable) and its parent cell on a 
+		shortest path from `start` (-1 for `start` and unreachable cells).
+	"""
+	full, not_first_col, not_last_col = bit_masks(size)
+	free = ~int(idx) & full
+	dists = [-1] * size**2
+	parents = [-1] * size**2
+	frontier = visited = 1 << int(start)
+	d = 0
+	while frontier:
+		layer = frontier
+		while layer:
+			low = layer & -layer
+			layer ^= low
+			dists[low.bit_length() - 1] = d
+		next_frontier = expand_bits(frontier, size) & free & ~visited
+		# (frontier moved one step in a direction, cell offset of that step)
+		moves = (
+			((frontier & not_last_col) << 1, 1), ((frontier & not_first_col) >> 1, -1),
+			(frontier << size, size), (frontier >> size, -size)
+		)
+		rest = next_frontier
+		for moved, offset in moves:
+			reached = rest & moved
+			rest ^= reached
+			while reached:
+				low = reached & -reached
+				reached ^= low
+				c = low.bit_length() - 1
+				parents[c] = c - offset
+		visited |= next_frontier
+		frontier = next_frontier
+		d += 1
+	return dists, parents
+
+
+def dijkstra_cells(idx, size, start, model):
+	"""Dijkstra search from cell `start` of the block with index `idx`, 
+	with the moves of the movement model `model` (see Movement.MovementModel).
+
+	Returns:
+		As bfs_cells, with the distances as costs of paths under `model`
+	"""
+	free = ~int(idx) & bit_masks(size)[0]
+	moves = model.cell_moves(size)
+	dists = [-1] * size**2
+	parents = [-1] * size**2
+	best = {int(start): 0}
+	heap = [(0, int(start))]
+	while heap:
+		d, c = heappop(heap)
+		if dists[c] >= 0:
+			continue
+		dists[c] = d
+		for nb, cost, required in moves[c]:
+			if required & ~free or dists[nb] >= 0:
+				continue
+			nd = d + cost
+			if nd < best.get(nb, np.inf):
+				best[nb] = nd
+				parents[nb] = c
+				heappush(heap, (nd, nb))
+	return dists, parents
+
+
+def local_search(idx, size, start, model=FOUR_CONNECTED):
+	"""Distances and parents of the cells of the block with index `idx` 
+	from cell `start`, as returned by bfs_cells, under movement model `model`"""
+	if model.diagonal:
+		return dijkstra_cells(idx, size, start, model)
+	return bfs_cells(idx, size, start)
 
 
 def bfs_to_all_points(block, start):
 	"""Perform Breadth First Search to all nodes starting from `start`
 	and return a tuple of distances and parent mappings.
 	"""
-	frontier = deque()
-	frontier.append(start)
-	dists = {start: 0}
-	parent = {}
-	parent[start] = None
+	size = block.size
+	dists, parents = bfs_cells(block.idx, size, start[0] * size + start[1])
+	nodes = [divmod(c, size) for c in range(size**2)]
+	node_dists = {nodes[c]: d for c, d in enumerate(dists) if d >= 0}
+	parent = {nodes[c]: (nodes[p] if p >= 0 else None) for c, p in enumerate(parents) if dists[c] >= 0}
+	return node_dists, parent
+
+
+def block_tables(block, model=FOUR_CONNECTED):
+	"""Distances and paths between all pairs of boundary nodes of `block`, 
+	with the moves of movement model `model`.
+
+	Returns:
+		A tuple of dicts, both keyed by (node1, node2) pairs: the distances
+		and the paths (lists of nodes) from node1 to node2.
+	"""
+	size = block.size
+	nodes, _ = boundary_slots(size)
+	cells = [y * size + x for y, x in nodes]
+	block_dists = {}
+	block_paths = {}
+	for start, s in zip(nodes, cells):
+		if (block.idx >> s) & 1:
+			continue
+		dists, parents = local_search(block.idx, size, s, model)
+		for k, c in zip(nodes, cells):
+			if dists[c] < 0:
+				continue
+			block_dists[(start, k)] = dists[c]
+			path = [k]
+			while parents[c] >= 0:
+				c = parents[c]
+				path.append(divmod(c, size))
+			block_paths[(start, k)] = path[::-1]
+	return block_dists, block_paths
+
+
+def dict_table(block_dists, block_size):
+	"""Distance table of a block, as returned by ArrayLDDB.table, from a dict 
+	of its distances as built by block_tables"""
+	nodes, slot = boundary_slots(block_size)
+	table = np.full((len(nodes), len(nodes)), np.inf)
+	for ((y1, x1), (y2, x2)), v in block_dists.items():
+		i, j = slot[y1][x1], slot[y2][x2]
+		if i >= 0 and j >= 0:
+			table[i, j] = v
+	return table
+
+
+class DictLDDB(object):
+	def __init__(self, lddb, block_size):
+		"""Adds the `table` lookup of ArrayLDDB to the list of dicts returned 
+		by make_lddb(dense=False)"""
+		super(DictLDDB, self).__init__()
+		self.lddb = lddb
+		self.block_size = block_size
+
+	def __len__(self):
+		return len(self.lddb)
+
+	def __getitem__(self, idx):
+		return self.lddb[idx]
+
+	def table(self, idx):
+		return dict_table(self.lddb[idx], self.block_size)
+
+
+def lddb_dtype(block_size):
+	"""Smallest unsigned integer type that can hold every local distance
+	of a block of the given size, plus the UNREACHABLE sentinel."""
+	return np.uint8 if block_size**2 < 255 else np.uint16
+
+
+class ArrayLDDB(object):
+	def __init__(self, block_size, dists=None, dtype=None):
+		"""Local Distance Database stored as a dense array of shape
+		(2**(block_size**2), n, n), where n is the number of boundary nodes.
+		Entry [idx, i, j] is the distance between boundary slots i and j
+		(see Block.boundary_slots) in the block with index idx, or
+		UNREACHABLE if there is no path between them. Distances are unsigned 
+		integers, or floats with UNREACHABLE = inf for movement models with 
+		non-integer costs.
+
+		Supports the same lookup interface as the list of dicts returned by 
+		make_lddb, i.e. lddb[idx].get((node1, node2), default).
+
+		Args:
+			block_size: size of blocks
+			dists: the distance array. If None, all entries are UNREACHABLE.
+			dtype: dtype of the distances if `dists` is None. Defaults to 
+				lddb_dtype(block_size).
+		"""
+		super(ArrayLDDB, self).__init__()
+		self.block_size = block_size
+		self.nodes, self.slot = boundary_slots(block_size)
+		n = len(self.nodes)
+		if dists is not None:
+			dtype = dists.dtype
+		elif dtype is None:
+			dtype = lddb_dtype(block_size)
+		self.UNREACHABLE = _unreachable(dtype)
+		if dists is None:
+			dists = np.full((2**(block_size**2), n, n), self.UNREACHABLE, dtype=dtype)
+		self.dists = dists
+
+	@classmethod
+	def from_dicts(cls, lddb, block_size, dtype=None):
+		"""Convert a list of dicts, as built by make_lddb, to an ArrayLDDB"""
+		out = cls(block_size, dtype=dtype)
+		slot = out.slot
+		for idx, block_dists in enumerate(lddb):
+			table = out.dists[idx]
+			for ((y1, x1), (y2, x2)), v in block_dists.items():
+				table[slot[y1][x1], slot[y2][x2]] = v
+		return out
+
+	def __len__(self):
+		return len(self.dists)
+
+	def __getitem__(self, idx):
+		return _LDDBRow(self, idx, self.dists[idx], self.slot)
+
+	def get(self, idx, node1, node2, default=np.inf):
+		return self[idx].get((node1, node2), default)
+
+	def table(self, idx):
+		"""Distances between the boundary slots of block idx as a float 
+		array of shape (n, n), with inf for unreachable pairs"""
+		t = self.dists[idx]
+		return np.where(t == self.UNREACHABLE, np.inf, t)
+
+	@property
+	def nbytes(self):
+		return self.dists.nbytes
+
+
+def _unreachable(dtype):
+	"""UNREACHABLE sentinel of a distance table of the given dtype"""
+	dtype = np.dtype(dtype)
+	return np.inf if dtype.kind == 'f' else np.iinfo(dtype).max
+
+
+class _LDDBRow(object):
+	"""View of the distances of a single block in an ArrayLDDB or a SymmetricLDDB.
+	`dists` is the block's distance table and `slot` maps the block's nodes
+	to rows/columns of the table.
+	"""
+	def __init__(self, lddb, idx, dists, slot):
+		self.lddb = lddb
+		self.idx = idx
+		self.dists = dists
+		self.slot = slot
+
+	def get(self, key, default=np.inf):
+		(y1, x1), (y2, x2) = key
+		slot = self.slot
+		i, j = slot[y1][x1], slot[y2][x2]
+		if i < 0 or j < 0:
+			return default
+		d = self.dists[i, j]
+		if d == self.lddb.UNREACHABLE:
+			return default
+		return d.item()
+
+	def __getitem__(self, key):
+		d = self.get(key, None)
+		if d is None:
+			raise KeyError(key)
+		return d
+
+	def __contains__(self, key):
+		return self.get(key, None) is not None
+
+
+class ArrayPathsDB(object):
+	def __init__(self, block_size, parents=None):
+		"""Local paths database stored as a dense predecessor array of shape 
+		(2**(block_size**2), n, block_size**2), where n is the number of 
+		boundary nodes. Entry [idx, i, c] is the parent of cell c, i.e. the 
+		previous node on the shortest path from boundary slot i to c, in the 
+		BFS tree of slot i in block idx. Cells are encoded as y * block_size + x. 
+		Entries for slot i's own cell and for unreachable cells are EMPTY. 
+		Paths are reconstructed on lookup by following the parents back to slot i.
+
+		Supports the same lookup interface as the list of dicts returned by 
+		make_lddb, i.e. pathsdb[idx][(node1, node2)], where node1 is a boundary
+		node and node2 is any node of the block.
+
+		Args:
+			block_size: size of blocks
+			parents: the predecessor array. If None, all entries are EMPTY.
+		"""
+		super(ArrayPathsDB, self).__init__()
+		self.block_size = block_size
+		self.nodes, self.slot = boundary_slots(block_size)
+		n = len(self.nodes)
+		self.EMPTY = np.iinfo(np.uint8).max
+		if parents is None:
+			parents = np.full((2**(block_size**2), n, block_size**2), self.EMPTY, dtype=np.uint8)
+		self.parents = parents
+		# stored node encoding: cells[c] = node encoded as c, cell_of[y][x] = encoding of node (y, x)
+		self.cells = [divmod(c, block_size) for c in range(block_size**2)]
+		self.cell_of = [[y * block_size + x for x in range(block_size)] for y in range(block_size)]
+
+	@classmethod
+	def from_dicts(cls, pathsdb, block_size):
+		"""Convert a list of dicts, as built by make_lddb, to an ArrayPathsDB. 
+		The paths from each node must form a tree, as those of block_tables do."""
+		out = cls(block_size)
+		slot = out.slot
+		for idx, block_paths in enumerate(pathsdb):
+			table = out.parents[idx]
+			for ((y1, x1), _), p in block_paths.items():
+				cells = [y * block_size + x for y, x in p]
+				table[slot[y1][x1], cells[1:]] = cells[:-1]
+		return out
+
+	def __len__(self):
+		return len(self.parents)
+
+	def __getitem__(self, idx):
+		return _PathsRow(self, idx, self.parents[idx], self.slot, self.cell_of, self.cells)
+
+	@property
+	def nbytes(self):
+		return self.parents.nbytes
+
+
+class _PathsRow(object):
+	"""View of the paths of a single block in an ArrayPathsDB or a SymmetricPathsDB.
+	`parents` is the block's predecessor table, `slot` maps the block's nodes 
+	to its rows, `cell_of` encodes the block's nodes and `cells` decodes them.
+	"""
+	def __init__(self, pathsdb, idx, parents, slot, cell_of, cells):
+		self.pathsdb = pathsdb
+		self.idx = idx
+		self.parents = parents
+		self.slot = slot
+		self.cell_of = cell_of
+		self.cells = cells
+
+	def get(self, key, default=None):
+		(y1, x1), (y2, x2) = key
+		i = self.slot[y1][x1]
+		if i < 0 or (int(self.idx) >> (y1 * self.pathsdb.block_size + x1)) & 1:
+			# not a boundary node, or an obstacle
+			return default
+		EMPTY, cells = self.pathsdb.EMPTY, self.cells
+		root, c = self.cell_of[y1][x1], self.cell_of[y2][x2]
+		parents = self.parents[i].tolist()
+		path = [cells[c]]
+		while c != root:
+			c = parents[c]
+			if c == EMPTY:
+				return default
+			path.append(cells[c])
+		return path[::-1]
+
+	def __getitem__(self, key):
+		p = self.get(key)
+		if p is None:
+			raise KeyError(key)
+		return p
+
+	def __contains__(self, key):
+		return self.get(key) is not None
+
+
+class SymmetricLDDB(object):
+	def __init__(self, block_size, dists, canonical, transform):
+		"""LDDB that stores a distance table only for one canonical block per 
+		orbit under rotations and reflections (see Block.canonical_blocks). 
+		The tables of other blocks are read from their canonical block's table, 
+		with the block's nodes mapped through the corresponding transform. 
+		This needs about 8 times less memory than an ArrayLDDB.
+
+		Supports the same lookup interface as ArrayLDDB.
+
+		Args:
+			block_size: size of blocks
+			dists: distance array of shape (n_canonical, n, n), laid out as in ArrayLDDB
+			canonical: canonical[idx] = row of `dists` holding the table of block idx
+			transform: transform[idx] = index of the transform in 
+				Block.dihedral_transforms that maps block idx to its canonical block
+		"""
+		super(SymmetricLDDB, self).__init__()
+		self.block_size = block_size
+		self.nodes, slot = boundary_slots(block_size)
+		self.UNREACHABLE = _unreachable(dists.dtype)
+		self.dists = dists
+		self.canonical = canonical
+		self.transform = transform
+		# slots[t][y][x] = slot in the canonical block of node (y, x) of a block with transform t
+		self.slots = [
+			[[slot[c // block_size][c % block_size] for c in perm[y * block_size: (y + 1) * block_size]] 
+				for y in range(block_size)]
+			for perm in dihedral_transforms(block_size)
+		]
+		# slot_perms[t][i] = slot in the canonical block of slot i of a block with transform t
+		self.slot_perms = [np.array([slots[y][x] for y, x in self.nodes]) for slots in self.slots]
+
+	def __len__(self):
+		return len(self.canonical)
+
+	def __getitem__(self, idx):
+		return _LDDBRow(self, idx, self.dists[self.canonical[idx]], self.slots[self.transform[idx]])
+
+	def get(self, idx, node1, node2, default=np.inf):
+		return self[idx].get((node1, node2), default)
+
+	def table(self, idx):
+		"""See ArrayLDDB.table"""
+		t = self.dists[self.canonical[idx]]
+		perm = self.slot_perms[self.transform[idx]]
+		t = t[np.ix_(perm, perm)]
+		return np.where(t == self.UNREACHABLE, np.inf, t)
+
+	@property
+	def nbytes(self):
+		return self.dists.nbytes + self.canonical.nbytes + self.transform.nbytes
+
+
+class SymmetricPathsDB(object):
+	def __init__(self, block_size, parents, canonical, transform):
+		"""Paths database counterpart of SymmetricLDDB. Stores the predecessor 
+		tables only for canonical blocks, with nodes encoded as in ArrayPathsDB 
+		in the canonical block's frame.
+
+		Args:
+			block_size: size of blocks
+			parents: predecessor array of shape (n_canonical, n, block_size**2), 
+				laid out as in ArrayPathsDB
+			canonical: as in SymmetricLDDB
+			transform: as in SymmetricLDDB
+		"""
+		super(SymmetricPathsDB, self).__init__()
+		self.block_size = block_size
+		self.nodes, slot = boundary_slots(block_size)
+		self.EMPTY = np.iinfo(np.uint8).max
+		self.parents = parents
+		self.canonical = canonical
+		self.transform = transform
+		perms = dihedral_transforms(block_size)
+		# per transform t: cell_of[t][y][x] = encoding of node (y, x) in the canonical 
+		# block, cells[t][c] = node whose encoding is c and slots[t] as in SymmetricLDDB
+		self.cell_of = [
+			[[perm[y * block_size + x] for x in range(block_size)] for y in range(block_size)]
+			for perm in perms
+		]
+		self.cells = [[None] * block_size**2 for _ in perms]
+		for t, perm in enumerate(perms):
+			for c, new_c in enumerate(perm):
+				self.cells[t][new_c] = divmod(c, block_size)
+		self.slots = [
+			[[slot[c // block_size][c % block_size] for c in row] for row in cell_of]
+			for cell_of in self.cell_of
+		]
+
+	def __len__(self):
+		return len(self.canonical)
+
+	def __getitem__(self, idx):
+		t = self.transform[idx]
+		return _PathsRow(self, idx, self.parents[self.canonical[idx]], self.slots[t], self.cell_of[t], self.cells[t])
+
+	@property
+	def nbytes(self):
+		return self.parents.nbytes + self.canonical.nbytes + self.transform.nbytes
+
+
+def make_symmetric_lddb(block_size, with_paths=True, batch_size=2**13):
+	"""Build a SymmetricLDDB and SymmetricPathsDB for blocks of given size.
+
+	Args:
+		block_size: size of blocks, at most 8
+		with_paths: if False, the SymmetricPathsDB is not built and None is returned instead
+		batch_size: number of blocks processed at once (see bfs_tables)
+
+	Returns:
+		A tuple of (SymmetricLDDB, SymmetricPathsDB)
+	"""
+	assert block_size <= 8, "block indices must fit in 64 bits"
+	t1 = timer()
+	n_blocks = 2**(block_size**2)
+	canonical_idxs = np.empty(n_blocks, dtype=np.uint64)
+	transform = np.empty(n_blocks, dtype=np.uint8)
+	for lo in range(0, n_blocks, 2**16):
+		hi = min(n_blocks, lo + 2**16)
+		idxs = np.arange(lo, hi, dtype=np.uint64)
+		canonical_idxs[lo:hi], transform[lo:hi] = canonical_blocks(idxs, block_size)
+	reps, canonical = np.unique(canonical_idxs, return_inverse=True)
+	canonical = canonical.astype(np.uint32)
+	del canonical_idxs
+
+	n = len(boundary_slots(block_size)[0])
+	dists = np.empty((len(reps), n, n), dtype=lddb_dtype(block_size))
+	parents = np.empty((len(reps), n, block_size**2), dtype=np.uint8) if with_paths else None
+	for lo in range(0, len(reps), batch_size):
+		hi = min(len(reps), lo + batch_size)
+		batch_dists, batch_parents = bfs_tables(reps[lo:hi], block_size, with_paths)
+		dists[lo:hi] = batch_dists
+		if with_paths:
+			parents[lo:hi] = batch_parents
+
+	lddb = SymmetricLDDB(block_size, dists, canonical, transform)
+	pathsdb = SymmetricPathsDB(block_size, parents, canonical, transform) if with_paths else None
+
+	dense_nbytes = n_blocks * dists[0].nbytes
+	print()
+	print(f"symmetric lddb created. {len(reps)} canonical blocks of {n_blocks}. {timer() - t1} seconds")
+	print(f"lddb memory: {lddb.nbytes / 2**20:.2f} MB symmetric, {dense_nbytes / 2**20:.2f} MB dense")
+	print()
+	return lddb, pathsdb
+
+
+class LazyLDDB(object):
+	def __init__(self, block_size, capacity=2**16, filename=None, model=FOUR_CONNECTED):
+		"""LDDB that computes the tables of a block the first time they are 
+		looked up (see block_tables) instead of precomputing all 2**(block_size**2) 
+		of them. Tables are kept in an LRU cache of at most `capacity` blocks.
+
+		Supports the lookup interface of the list of dicts returned by make_lddb. 
+		The matching paths database is `self.pathsdb`, e.g.
+			lddb = LazyLDDB(6)
+			block_a_star(lddb, lddb.pathsdb, Map, start, goal, h)
+
+		Args:
+			block_size: size of blocks
+			capacity: max number of blocks kept in memory
+			filename: if given, tables computed on a miss are also stored in 
+				this shelve file and looked up there on later misses, 
+				including by other runs.
+			model: movement model of the local paths, see Movement.MovementModel
+		"""
+		super(LazyLDDB, self).__init__()
+		self.block_size = block_size
+		self.model = model
+		self.capacity = capacity
+		self._cache = OrderedDict()
+		self._store = shelve.open(filename) if filename is not None else None
+		self.pathsdb = _LazyPathsDB(self)
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		# misses that were not found in the shelve file either
+		self.computed = 0
+
+	def tables(self, idx):
+		"""Distances and paths of block idx, as returned by block_tables, 
+		and its distance table, as returned by table"""
+		try:
+			tables = self._cache[idx]
+			self._cache.move_to_end(idx)
+			self.hits += 1
+			return tables
+		except KeyError:
+			pass
+
+		self.misses += 1
+		key = str(idx)
+		if self._store is not None and key in self._store:
+			block_dists, block_paths = self._store[key]
+		else:
+			block_dists, block_paths = block_tables(Block(idx, self.block_size), self.model)
+			self.computed += 1
+			if self._store is not None:
+				self._store[key] = (block_dists, block_paths)
+
+		tables = (block_dists, block_paths, dict_table(block_dists, self.block_size))
+		self._cache[idx] = tables
+		if len(self._cache) > self.capacity:
+			self._cache.popitem(last=False)
+			self.evictions += 1
+		return tables
+
+	def __getitem__(self, idx):
+		return self.tables(idx)[0]
+
+	def table(self, idx):
+		"""See ArrayLDDB.table"""
+		return self.tables(idx)[2]
+
+	def stats(self):
+		return {
+			'hits': self.hits, 'misses': self.misses, 
+			'evictions': self.evictions, 'computed': self.computed, 
+			'cached': len(self._cache)
+		}
 
-	while len(frontier) > 0:
-		curr = frontier.popleft()
-		nghbs = neighbors(block, curr)
+	def close(self):
+		if self._store is not None:
+			self._store.close()
+			self._store = None
 
-		node_dist_from_curr = dists[curr] + 1
-		for n in nghbs:
-			if n not in dists:# or node_dist_from_curr < dists[n]:
-				dists[n] = node_dist_from_curr
-				frontier.append(n)
-				parent[n] = curr
 
-	return dists, parent
+class _LazyPathsDB(object):
+	"""Paths database view of a LazyLDDB"""
+	def __init__(self, lddb):
+		self.lddb = lddb
+
+	def __getitem__(self, idx):
+		return self.lddb.tables(idx)[1]
+
+
+###############################################################################################
+# On-disk format
+###############################################################################################
+# An LDDB file consists of a fixed-size header followed by the distance table of an 
+# ArrayLDDB and the predecessor table of an ArrayPathsDB, each stored as a raw C-order 
+# array starting at a page-aligned offset, so that both can be opened with np.memmap.
+#
+# Version 1 files stored every path in full, in a table of shape 
+# (n_blocks, n_slots, n_slots, path_len). Only those built without paths can be loaded.
+#
+# Header (little-endian):
+#	magic		 4s  b'LDDB'
+#	version		 H
+#	block_size	 H
+#	dist_itemsize H   1 (uint8), 2 (uint16) or 8 (float64, for non-integer move costs)
+#	n_slots		 H   number of boundary nodes per block
+#	path_len	 H   number of cells per predecessor table row (block_size**2), 0 if no paths
+#	n_blocks	 Q
+#	dists_offset Q
+#	paths_offset Q
+LDDB_MAGIC = b'LDDB'
+LDDB_VERSION = 2
+_HEADER = struct.Struct('<4sHHHHHQQQ')
+_PAGE = 4096
+
+
+def lddb_filename(block_size, model=FOUR_CONNECTED):
+	"""Default file name of the LDDB for blocks of given size and movement model"""
+	suffix = f'_{model.name}' if model.name else ''
+	return f'lddb_{block_size}{suffix}.bin'
+
+
+def _align(offset):
+	return (offset + _PAGE - 1) // _PAGE * _PAGE
+
+
+def _layout(block_size, with_paths, dtype=None):
+	"""Header and total size of the LDDB file for blocks of given size, 
+	with distances of the given dtype (lddb_dtype(block_size) by default)"""
+	n_slots = len(boundary_slots(block_size)[0])
+	n_blocks = 2**(block_size**2)
+	dist_itemsize = np.dtype(dtype or lddb_dtype(block_size)).itemsize
+	path_len = block_size**2 if with_paths else 0
+	dists_offset = _align(_HEADER.size)
+	paths_offset = _align(dists_offset + n_blocks * n_slots * n_slots * dist_itemsize)
+	header = _HEADER.pack(
+		LDDB_MAGIC, LDDB_VERSION, block_size, dist_itemsize, 
+		n_slots, path_len, n_blocks, dists_offset, paths_offset
+	)
+	return header, paths_offset + n_blocks * n_slots * path_len
+
+
+def save_lddb(filename, lddb, pathsdb=None):
+	"""Write an ArrayLDDB and, optionally, an ArrayPathsDB to `filename` 
+	in the LDDB file format"""
+	header, _ = _layout(lddb.block_size, pathsdb is not None, lddb.dists.dtype)
+	dists_offset, paths_offset = _HEADER.unpack(header)[-2:]
+	with open(filename, 'wb') as f:
+		f.write(header)
+		f.seek(dists_offset)
+		f.write(np.ascontiguousarray(lddb.dists).data)
+		if pathsdb is not None:
+			f.seek(paths_offset)
+			f.write(np.ascontiguousarray(pathsdb.parents).data)
+
+
+def load_lddb(filename, mode='r'):
+	"""Open an LDDB file without reading it into memory. The tables are
+	memory-mapped, so loading takes constant time and processes that open 
+	the same file share its pages through the OS page cache.
+
+	Args:
+		filename: LDDB file
+		mode: np.memmap mode. The tables are read-only by default.
+
+	Returns:
+		A tuple of (ArrayLDDB, ArrayPathsDB). The ArrayPathsDB is None if
+		the file was built without paths.
+	"""
+	with open(filename, 'rb') as f:
+		header = f.read(_HEADER.size)
+	(magic, version, block_size, dist_itemsize, n_slots, 
+		path_len, n_blocks, dists_offset, paths_offset) = _HEADER.unpack(header)
+	if magic != LDDB_MAGIC:
+		raise ValueError(f"{filename} is not an LDDB file")
+	if version not in (1, LDDB_VERSION):
+		raise ValueError(f"{filename}: unsupported LDDB version {version}")
+	if version == 1 and path_len > 0:
+		raise ValueError(f"{filename}: version 1 LDDB file with full paths, rebuild it with `python LDDB.py build`")
+
+	dist_dtype = {1: np.uint8, 2: np.uint16, 8: np.float64}[dist_itemsize]
+	dists = np.memmap(filename, dtype=dist_dtype, mode=mode, 
+		offset=dists_offset, shape=(n_blocks, n_slots, n_slots))
+	pathsdb = None
+	if path_len > 0:
+		parents = np.memmap(filename, dtype=np.uint8, mode=mode, 
+			offset=paths_offset, shape=(n_blocks, n_slots, path_len))
+		pathsdb = ArrayPathsDB(block_size, parents)
+	return ArrayLDDB(block_size, dists), pathsdb
 
 
-def make_lddb(block_size, from_file=False, save_to_file=True):
+def convert_pickle(pkl_file, block_size, filename=None):
+	"""Convert a pickled (lddb, paths) pair of lists of dicts, as saved by 
+	earlier versions of make_lddb, to the LDDB file format.
+
+	Args:
+		pkl_file: the pickle file
+		block_size: size of the blocks in the pickled LDDB
+		filename: output file. Defaults to lddb_filename(block_size).
+	"""
+	with open(pkl_file, 'rb') as f_in:
+		lddb, paths = pickle.load(f_in)
+	if filename is None:
+		filename = lddb_filename(block_size)
+	save_lddb(filename, ArrayLDDB.from_dicts(lddb, block_size), ArrayPathsDB.from_dicts(paths, block_size))
+	return filename
+
+
+def make_lddb(block_size, from_file=False, save_to_file=True, dense=False, model=FOUR_CONNECTED):
 	"""Populate the Local Distance Database (LDDB) for blocks of given size.
 
 	Args:
 		block_size: size of blocks
-		from_file: if True, will load LDDB from file
-		save_to_file: if True, will save constructed LDDB to file
+		from_file: if True, will memory-map the LDDB from lddb_filename(block_size, model)
+		save_to_file: if True, will save constructed LDDB to lddb_filename(block_size, model)
+		dense: if True, the LDDB and paths are returned as an ArrayLDDB and 
+			an ArrayPathsDB. LDDBs loaded from file are always dense.
+		model: movement model of the local paths, see Movement.MovementModel
 	"""
 	if from_file:
-		with open('lddb.pkl', 'rb') as f_in:
-			lddb, paths = pickle.load(f_in)
-		return lddb, paths
+		return load_lddb(lddb_filename(block_size, model))
 
 	t1 = timer() 
 	size = block_size
@@ -51,30 +742,202 @@ def make_lddb(block_size, from_file=False, save_to_file=True):
 	paths = [None] * 2**(size**2)
 
 	for idx in range(2**(size**2)):
-		block = Block(idx, size)
-		block_dists = {}
-		block_paths = {}
-		for n in visitable(block, boundary_nodes(block)):
-			start = n
-			dists, parent_map = bfs_to_all_points(block, start)
-			for k, v in dists.items():
-				if is_boundary_node(block, k):
-					block_dists[(start, k)] = v
-					block_paths[(start, k)] = get_path_from_parent_map(parent_map, k)
-
-		lddb[idx] = block_dists
-		paths[idx] = block_paths
+		lddb[idx], paths[idx] = block_tables(Block(idx, size), model)
 
 	print()
 	print(f"lddb created. Size:  {len(lddb)}. {timer() - t1} seconds")
+	if dense or save_to_file:
+		dense_lddb = ArrayLDDB.from_dicts(lddb, size, model.dist_dtype)
+		dense_paths = ArrayPathsDB.from_dicts(paths, size)
+	if dense:
+		pickled_size = len(pickle.dumps(lddb))
+		print(f"lddb memory: {dense_lddb.nbytes / 2**20:.2f} MB dense, {pickled_size / 2**20:.2f} MB pickled dicts")
+		pickled_size = len(pickle.dumps(paths))
+		print(f"paths memory: {dense_paths.nbytes / 2**20:.2f} MB predecessors, {pickled_size / 2**20:.2f} MB pickled dicts")
 	print()
 
-	if not from_file and save_to_file:
-		# save to file
-		f_pkl = 'lddb.pkl'
-		data = (lddb, paths)
-		with open(f_pkl, "wb") as f:
-		    pickle.dump(data, f)
+	if save_to_file:
+		save_lddb(lddb_filename(size, model), dense_lddb, dense_paths)
 
+	if dense:
+		return dense_lddb, dense_paths
 	return lddb, paths
-	
\ No newline at end of file
+
+
+###############################################################################################
+# Parallel builder
+###############################################################################################
+def bfs_tables(idxs, size, with_paths=True):
+	"""Batched, bit-parallel BFS from every boundary node of every block in `idxs`.
+	Each BFS frontier is a set of nodes encoded like a block index, so a whole 
+	layer is expanded with a few shifts and masks (see Block.expand_bits), and 
+	the blocks in `idxs` are processed simultaneously as a numpy array.
+
+	Args:
+		idxs: numpy uint64 array of block indices
+		size: size of blocks
+		with_paths: if True, also compute the predecessor table
+
+	Returns:
+		A tuple of the distances and predecessors of the blocks in `idxs`, in 
+		the layout of ArrayLDDB.dists and ArrayPathsDB.parents. Predecessors 
+		are None if with_paths is False.
+	"""
+	nodes, _ = boundary_slots(size)
+	n, n_cells, N = len(nodes), size**2, len(idxs)
+	full = bit_masks(size)[0]
+	dtype = lddb_dtype(size)
+	UNREACHABLE = np.iinfo(dtype).max
+
+	cells = np.arange(n_cells, dtype=np.uint64)
+	boundary_cells = np.array([y * size + x for y, x in nodes])
+	# neighbors[c] = the (up to 4) cells adjacent to cell c, -1 if outside the block
+	neighbors = np.full((n_cells, 4), -1)
+	for c in range(n_cells):
+		y, x = divmod(c, size)
+		for k, (ny, nx) in enumerate(adjacent_nodes((y, x))):
+			if 0 <= ny < size and 0 <= nx < size:
+				neighbors[c, k] = ny * size + nx
+
+	free = ~idxs & np.uint64(full)
+	dists = np.full((N, n, n), UNREACHABLE, dtype=dtype)
+	parents = np.full((N, n, n_cells), 255, dtype=np.uint8) if with_paths else None
+	has_neighbor = neighbors >= 0
+
+	for s, start in enumerate(boundary_cells):
+		# distance of every cell from `start`, -1 if unreachable
+		cell_dists = np.full((N, n_cells), -1, dtype=np.int16)
+		frontier = free & (np.uint64(1) << np.uint64(start))
+		visited = frontier
+		d = 0
+		while frontier.any():
+			cell_dists[((frontier[:, None] >> cells) & 1).astype(bool)] = d
+			frontier = expand_bits(frontier, size) & free & ~visited
+			visited = visited | frontier
+			d += 1
+
+		boundary_dists = cell_dists[:, boundary_cells]
+		reachable = boundary_dists >= 0
+		dists[:, s][reachable] = boundary_dists[reachable]
+		if not with_paths:
+			continue
+
+		# the parent of every cell reached after `start` is its first neighbor 
+		# that is one layer closer to `start`
+		neighbor_dists = cell_dists[:, np.where(has_neighbor, neighbors, 0)]
+		is_prev = has_neighbor & (neighbor_dists == (cell_dists - 1)[:, :, None])
+		reached = (cell_dists > 0)
+		prev = neighbors[np.arange(n_cells), is_prev.argmax(axis=2)]
+		parents[:, s][reached] = prev[reached]
+
+	return dists, parents
+
+
+def _build_shard(args):
+	"""Fill the tables of blocks lo..hi-1 in an LDDB file. Runs in a worker process."""
+	filename, lo, hi, batch_size = args
+	lddb, pathsdb = load_lddb(filename, mode='r+')
+	for batch_lo in range(lo, hi, batch_size):
+		batch_hi = min(hi, batch_lo + batch_size)
+		idxs = np.arange(batch_lo, batch_hi, dtype=np.uint64)
+		dists, parents = bfs_tables(idxs, lddb.block_size, pathsdb is not None)
+		lddb.dists[batch_lo:batch_hi] = dists
+		if pathsdb is not None:
+			pathsdb.parents[batch_lo:batch_hi] = parents
+	lddb.dists.flush()
+	if pathsdb is not None:
+		pathsdb.parents.flush()
+	return lo
+
+
+def build_lddb(block_size, filename=None, workers=None, shard_size=2**16, batch_size=2**13, with_paths=True):
+	"""Build the LDDB file for blocks of given size in parallel.
+
+	The tables are those of 4-connected moves; make_lddb builds the LDDB 
+	of other movement models.
+
+	The block index range is split into shards of `shard_size` blocks which
+	are computed by a pool of worker processes (see bfs_tables) and written 
+	directly into the memory-mapped output file. Completed shards are recorded 
+	in `<filename>.progress`, so an interrupted build resumes where it stopped
+	when called again with the same arguments.
+
+	Args:
+		block_size: size of blocks, at most 8
+		filename: output file. Defaults to lddb_filename(block_size).
+		workers: number of worker processes. Defaults to the number of CPUs.
+		shard_size: number of blocks per shard
+		batch_size: number of blocks processed at once by a worker
+		with_paths: if False, only the distance table is built
+
+	Returns:
+		The memory-mapped (ArrayLDDB, ArrayPathsDB), as returned by load_lddb
+	"""
+	assert block_size <= 8, "block indices must fit in 64 bits"
+	if filename is None:
+		filename = lddb_filename(block_size)
+	progress_file = filename + '.progress'
+
+	t1 = timer()
+	header, file_size = _layout(block_size, with_paths)
+	done = set()
+	if os.path.exists(progress_file) and os.path.exists(filename):
+		with open(progress_file) as f:
+			done = {int(line) for line in f if line.strip()}
+		print(f"resuming {filename}: {len(done)} shards done")
+	else:
+		with open(filename, 'wb') as f:
+			f.write(header)
+			f.truncate(file_size)
+		open(progress_file, 'w').close()
+
+	n_blocks = 2**(block_size**2)
+	shards = [
+		(filename, lo, min(n_blocks, lo + shard_size), batch_size) 
+		for lo in range(0, n_blocks, shard_size) if lo not in done
+	]
+	with open(progress_file, 'a') as progress:
+		if workers == 1:
+			completed = map(_build_shard, shards)
+			pool = None
+		else:
+			pool = mp.Pool(workers)
+			completed = pool.imap_unordered(_build_shard, shards)
+		try:
+			for i, lo in enumerate(completed):
+				progress.write(f"{lo}\n")
+				progress.flush()
+				print(f"shard {i + 1}/{len(shards)} done. {timer() - t1:.1f} seconds")
+		finally:
+			if pool is not None:
+				pool.terminate()
+	os.remove(progress_file)
+
+	print(f"lddb built. Size: {n_blocks}. {timer() - t1} seconds")
+	return load_lddb(filename)
+
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Build or convert Local Distance Databases')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	build = subparsers.add_parser('build', help='build the LDDB for a block size')
+	build.add_argument('block_size', type=int)
+	build.add_argument('-o', '--output', default=None)
+	build.add_argument('-w', '--workers', type=int, default=None)
+	build.add_argument('--shard-size', type=int, default=2**16)
+	build.add_argument('--no-paths', action='store_true')
+
+	convert = subparsers.add_parser('convert', help='convert a pickled LDDB to the LDDB file format')
+	convert.add_argument('pkl_file')
+	convert.add_argument('block_size', type=int)
+	convert.add_argument('-o', '--output', default=None)
+
+	args = parser.parse_args()
+	if args.command == 'build':
+		build_lddb(args.block_size, args.output, workers=args.workers, 
+			shard_size=args.shard_size, with_paths=not args.no_paths)
+	else:
+		print(convert_pickle(args.pkl_file, args.block_size, args.output))
@@ -0,0 +1,127 @@
+import numpy as np
+
+
+def bfs_distances(Map, source):
+	"""Distances of all cells of the grid Map from `source`, by a breadth
+	first search that advances the whole frontier at once.
+
+	Args:
+		Map: 2D numpy array containing zeros and ones
+		source: address of the source node
+
+	Returns:
+		int32 array of the shape of Map, -1 for cells that cannot be reached
+	"""
+	free = Map == 0
+	dist = np.full(Map.shape, -1, dtype=np.int32)
+	frontier = np.zeros_like(free)
+	frontier[source] = free[source]
+	d = 0
+	while frontier.any():
+		dist[frontier] = d
+		reached = np.zeros_like(free)
+		reached[1:] |= frontier[:-1]
+		reached[:-1] |= frontier[1:]
+		reached[:, 1:] |= frontier[:, :-1]
+		reached[:, :-1] |= frontier[:, 1:]
+		frontier = reached & free & (dist < 0)
+		d += 1
+	return dist
+
+
+class LandmarkHeuristic(object):
+	def __init__(self, Map=None, n_landmarks=8, landmarks=None, dists=None, seed=None):
+		"""ALT heuristic: lower bounds on distances from precomputed
+		distances to a few landmark cells.
+
+		By the triangle inequality, |d(L, node) - d(L, goal)| <= d(node, goal)
+		for every landmark L, so the maximum of these bounds, and of the L1
+		distance, is an admissible and consistent heuristic. It is much
+		closer to the true distance than L1 alone on cluttered maps. An
+		instance is called like common.l1_dist, so it can be passed as the
+		`h` argument of a_star, block_a_star and the solvers. The bounds are
+		on 4-connected unit cost distances, so it is not admissible for
+		movement models with diagonal moves (see Movement.MovementModel).
+
+		Landmarks are chosen greedily, each one as far as possible from the
+		previous ones, starting from a random free cell. A cell that no
+		landmark reaches counts as infinitely far, so every component of the
+		map gets a landmark before any component gets a second one. The
+		distance tables are computed with bfs_distances and can be saved with
+		save and loaded back with load.
+
+		Args:
+			Map: 2D numpy array containing zeros and ones. For a BlockMap,
+				pass its (expanded) grid, block_map._map.
+			n_landmarks: number of landmarks to choose
+			landmarks: addresses of the landmarks, instead of choosing them
+			dists: precomputed distance tables, of shape (h, w, n_landmarks),
+				as stored by save
+			seed: seed of the choice of the first landmark
+		"""
+		super(LandmarkHeuristic, self).__init__()
+		if dists is None:
+			if landmarks is None:
+				landmarks, tables = self._choose_landmarks(Map, n_landmarks, seed)
+			else:
+				tables = [bfs_distances(Map, tuple(l)) for l in landmarks]
+			dists = np.stack(tables, axis=-1)
+		self.landmarks = [tuple(int(v) for v in l) for l in landmarks]
+		# dists[y, x] holds the distances of cell (y, x) to all landmarks
+		self.dists = dists
+		self._goal = None
+		self._goal_dists = None
+
+	@staticmethod
+	def _choose_landmarks(Map, n_landmarks, seed):
+		free = Map == 0
+		cells = np.argwhere(free)
+		if len(cells) == 0:
+			return [], [np.full(Map.shape, -1, dtype=np.int32)]
+		rng = np.random.RandomState(seed)
+		landmark = tuple(cells[rng.randint(len(cells))].tolist())
+		landmarks, tables = [], []
+		nearest = np.full(Map.shape, np.iinfo(np.int64).max)
+		for _ in range(min(n_landmarks, len(cells))):
+			landmarks.append(landmark)
+			table = bfs_distances(Map, landmark)
+			tables.append(table)
+			nearest = np.where(table >= 0, np.minimum(nearest, table), nearest)
+			landmark = np.unravel_index(np.argmax(np.where(free, nearest, -1)), Map.shape)
+		return landmarks, tables
+
+	def __call__(self, node, goal):
+		y, x = node
+		gy, gx = goal
+		l1 = abs(y - gy) + abs(x - gx)
+		if goal != self._goal:
+			self._goal = goal
+			self._goal_dists = self.dists[goal]
+		d_node, d_goal = self.dists[node], self._goal_dists
+		# only landmarks that reach both cells give a bound
+		valid = (d_node >= 0) & (d_goal >= 0)
+		if not valid.any():
+			return l1
+		return max(l1, int(np.abs(d_node - d_goal)[valid].max()))
+
+	def batch(self, ys, xs, goal):
+		"""The heuristic of the nodes (ys[i], xs[i]), for arrays ys and xs"""
+		gy, gx = goal
+		l1 = np.abs(ys - gy) + np.abs(xs - gx)
+		# cells past the tables, like the padding of a BlockMap, are obstacles
+		# and their values are never used
+		h, w = self.dists.shape[:2]
+		d_nodes = self.dists[np.minimum(ys, h - 1), np.minimum(xs, w - 1)]
+		d_goal = self.dists[goal]
+		bounds = np.where((d_nodes >= 0) & (d_goal >= 0), np.abs(d_nodes - d_goal), 0)
+		return np.maximum(l1, bounds.max(axis=-1, initial=0))
+
+	def save(self, filename):
+		"""Save the landmarks and their distance tables to `filename`, an .npz file"""
+		np.savez(filename, landmarks=np.array(self.landmarks, dtype=np.int64).reshape(-1, 2), dists=self.dists)
+
+	@classmethod
+	def load(cls, filename):
+		"""Load a LandmarkHeuristic saved with save"""
+		with np.load(filename) as data:
+			return cls(landmarks=data['landmarks'], dists=data['dists'])
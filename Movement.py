@@ -0,0 +1,109 @@
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+from Block import DIRECTIONS, CORNERS
+from common import SQRT2, chebyshev_dist, l1_dist, octile_dist
+
+
+class MovementModel(object):
+	def __init__(self, diagonal=False, diagonal_cost=1, h=l1_dist, name=''):
+		"""Moves allowed between the cells of a grid, and their costs before
+		the cost multipliers of the blocks (see BlockMap.costs).
+
+		Straight moves, to the 4 adjacent cells, cost 1. If `diagonal` is
+		True, moves to the 4 diagonal cells are allowed too, but only if both
+		cells next to both ends of the move are free, so paths never cut the
+		corner of an obstacle. Every diagonal move can then be replaced by two
+		straight ones, so the connected components of a map are the same
+		under all models.
+
+		Args:
+			diagonal: if True, diagonal moves are allowed
+			diagonal_cost: cost of a diagonal move
+			h: a heuristic that is admissible for the model
+			name: name of the model in LDDB file names, see LDDB.lddb_filename
+		"""
+		super(MovementModel, self).__init__()
+		self.diagonal = diagonal
+		self.diagonal_cost = diagonal_cost
+		self.h = h
+		self.name = name
+		# (dy, dx, cost) of the moves
+		self.moves = [(dy, dx, 1) for dy, dx in DIRECTIONS]
+		if diagonal:
+			self.moves += [(dy, dx, diagonal_cost) for dy, dx in CORNERS]
+		# offsets of the neighbor blocks a block can be left to, indexed by side
+		self.block_sides = DIRECTIONS + CORNERS if diagonal else DIRECTIONS
+		# dtype of the local distances, None for the smallest unsigned integer
+		# type that holds them (see LDDB.lddb_dtype)
+		self.dist_dtype = None if float(diagonal_cost).is_integer() else np.float64
+
+	def neighbors(self, Map, node):
+		"""Free cells of the grid Map reachable from `node` in one move, as
+		a list of (cell, cost of the move)"""
+		y, x = node
+		h, w = Map.shape
+		out = []
+		for dy, dx, cost in self.moves:
+			ny, nx = y + dy, x + dx
+			if not (0 <= ny < h and 0 <= nx < w) or Map[ny, nx]:
+				continue
+			if dy and dx and (Map[y, nx] or Map[ny, x]):
+				continue
+			out.append(((ny, nx), cost))
+		return out
+
+	@lru_cache(None)
+	def cell_moves(self, size):
+		"""Moves within a size x size block: moves[c] is the list of
+		(cell, cost, required) of the moves from cell c, where required is the
+		mask, encoded like a block index, of the cells that must be free."""
+		moves = [[] for _ in range(size * size)]
+		for c in range(size * size):
+			y, x = divmod(c, size)
+			for dy, dx, cost in self.moves:
+				ny, nx = y + dy, x + dx
+				if not (0 <= ny < size and 0 <= nx < size):
+					continue
+				required = 1 << (ny * size + nx)
+				if dy and dx:
+					required |= (1 << (y * size + nx)) | (1 << (ny * size + x))
+				moves[c].append((ny * size + nx, cost, required))
+		return moves
+
+	@lru_cache(None)
+	def side_pairs(self, size):
+		"""Moves out of a size x size block, grouped by the neighbor block
+		they lead to.
+
+		Returns:
+			A list over the sides in self.block_sides of lists of
+			(cell, neighbor cell, cost, required), one per move from a cell of
+			the block to a cell of the neighbor block on that side. `required`
+			is a tuple of (block offset, mask) pairs: the cells, encoded like
+			block indices, that must be free in the block at that offset from
+			the block for the move to be valid.
+		"""
+		pairs = [[] for _ in self.block_sides]
+		for c in range(size * size):
+			y, x = divmod(c, size)
+			for dy, dx, cost in self.moves:
+				ny, nx = y + dy, x + dx
+				if 0 <= ny < size and 0 <= nx < size:
+					continue
+				cells = [(y, x), (ny, nx)] + ([(y, nx), (ny, x)] if dy and dx else [])
+				required = defaultdict(int)
+				for cy, cx in cells:
+					required[cy // size, cx // size] |= 1 << ((cy % size) * size + cx % size)
+				side = self.block_sides.index((ny // size, nx // size))
+				pairs[side].append((c, (ny % size) * size + nx % size, cost, tuple(required.items())))
+		return pairs
+
+
+# 4-connected moves of cost 1, the model of the paper
+FOUR_CONNECTED = MovementModel()
+# 8-connected moves of cost 1
+EIGHT_CONNECTED = MovementModel(diagonal=True, diagonal_cost=1, h=chebyshev_dist, name='8')
+# 8-connected moves, diagonal ones of cost sqrt(2)
+OCTILE = MovementModel(diagonal=True, diagonal_cost=SQRT2, h=octile_dist, name='octile')
@@ -0,0 +1,121 @@
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from BlockMap import BlockMap
+from BlockAStarSolver import BlockAStarSolver
+from LDDB import load_lddb, lddb_filename
+from Movement import FOUR_CONNECTED
+from PriorityQueue import PriorityQueue
+from common import l1_dist
+
+
+# per-process state of a worker, set by _init_worker
+_worker = None
+
+
+def _share(arrays):
+	"""Copy the arrays of the dict `arrays` into a new shared memory block.
+	Returns the block and the dict of the (shape, dtype, offset) of each
+	array in it."""
+	layout, size = {}, 0
+	for name, a in arrays.items():
+		layout[name] = (a.shape, a.dtype.str, size)
+		# keep every array 8-byte aligned
+		size += -(-a.nbytes // 8) * 8
+	shm = SharedMemory(create=True, size=max(1, size))
+	for name, a in arrays.items():
+		_view(shm, layout[name])[...] = a
+	return shm, layout
+
+
+def _view(shm, spec):
+	shape, dtype, offset = spec
+	return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+
+
+def _init_worker(shm_name, layout, block_size, lddb_file, h, queue, model):
+	global _worker
+	shm = SharedMemory(name=shm_name)
+	arrays = {name: _view(shm, spec) for name, spec in layout.items()}
+	block_map = BlockMap(arrays.pop('map'), block_size, copy=False, **arrays)
+	lddb, pathsdb = load_lddb(lddb_file)
+	# keep a reference to shm, the arrays are only valid while it is open
+	_worker = (shm, BlockAStarSolver(block_map, lddb, pathsdb, h, queue=queue, model=model))
+
+
+def _solve_chunk(chunk):
+	_, solver = _worker
+	return [(i, *solver.solve(start, goal)) for i, start, goal in chunk]
+
+
+class ParallelBlockAStar(object):
+	def __init__(self, Map, block_size, lddb_file=None, workers=None, h=l1_dist, 
+			queue=PriorityQueue, model=FOUR_CONNECTED, costs=None):
+		"""Runs Block A* queries on a pool of worker processes.
+
+		The map is expanded and its block indices, egress masks and costs are 
+		computed once, by a BlockMap in this process, and placed in shared 
+		memory, where the BlockMaps of the workers use them without copying. 
+		The LDDB is memory-mapped from its file by every worker (see 
+		LDDB.load_lddb). None of them is copied per worker or pickled per 
+		task. Each worker answers its queries with a BlockAStarSolver.
+
+		Args:
+			Map: 2D numpy array containing zeros and ones
+			block_size: Map will be divided into block_size x block_size blocks
+			lddb_file: LDDB file. Defaults to lddb_filename(block_size, model).
+			workers: number of worker processes. Defaults to the number of CPUs.
+			h: heuristic function. Must be picklable.
+			queue: class of the open list, see block_a_star. Must be picklable.
+			model: movement model of the LDDB, see block_a_star
+			costs: cost multipliers of the blocks, see BlockMap
+		"""
+		super(ParallelBlockAStar, self).__init__()
+		if lddb_file is None:
+			lddb_file = lddb_filename(block_size, model)
+		block_map = BlockMap(Map, block_size, costs)
+		arrays = dict(map=block_map._map, egress=block_map.egress, costs=block_map.costs)
+		# indices of blocks of more than 64 cells are Python ints, which cannot
+		# be shared; the workers compute them instead
+		if block_map.idxs.dtype != object:
+			arrays['idxs'] = block_map.idxs
+		self._shm, layout = _share(arrays)
+		self._pool = mp.Pool(workers, initializer=_init_worker, 
+			initargs=(self._shm.name, layout, block_size, lddb_file, h, queue, model))
+
+	def imap(self, pairs, chunk_size=64):
+		"""Solve (start, goal) pairs in parallel.
+
+		Args:
+			pairs: iterable of (start, goal) pairs
+			chunk_size: number of queries sent to a worker at a time
+
+		Yields:
+			(i, goal_found, path, stats) for the ith pair, as returned by
+			BlockAStarSolver.solve, in order of completion.
+		"""
+		pairs = [(i, start, goal) for i, (start, goal) in enumerate(pairs)]
+		chunks = [pairs[i: i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+		for results in self._pool.imap_unordered(_solve_chunk, chunks):
+			yield from results
+
+	def solve_many(self, pairs, chunk_size=64):
+		"""Solve (start, goal) pairs in parallel and return the results of 
+		BlockAStarSolver.solve in the order of `pairs`."""
+		results = [None] * len(pairs)
+		for i, *result in self.imap(pairs, chunk_size):
+			results[i] = tuple(result)
+		return results
+
+	def close(self):
+		self._pool.close()
+		self._pool.join()
+		self._shm.close()
+		self._shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
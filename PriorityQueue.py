@@ -42,11 +42,12 @@ class PriorityQueue(object):
 		raise KeyError('pop from an empty priority queue')
 
 	def top(self):
+		'Return the lowest priority item and its priority, without removing it'
 		while self.pq:
-			entry = heappop(self.pq)
+			entry = self.pq[0]
 			if entry[-1] is not REMOVED:
-				heappush(self.pq, entry)
 				return entry[-1], entry[0]
+			heappop(self.pq)
 		raise KeyError('top() on an empty priority queue')
 
 	def priority(self, item):
@@ -63,3 +64,183 @@ class PriorityQueue(object):
 
 	def __str__(self):
 		return str(self.pq)
+
+
+class IndexedHeap(object):
+	"""Binary heap that keeps the position of every item, so that pushing an 
+	item that is already in the queue changes its priority in place instead 
+	of leaving a removed entry behind. The heap never holds more entries than 
+	there are items in it, and top() is a lookup.
+
+	Has the same interface as PriorityQueue. Items with equal priorities are 
+	popped in the order in which they were last pushed.
+	"""
+
+	def __init__(self):
+		super(IndexedHeap, self).__init__()
+		self.heap = []							# entries [priority, count, item]
+		self.index = {}							# item -> position of its entry in heap
+		self.counter = itertools.count()
+
+	def push(self, item, priority=0):
+		'Add a new item or update the priority of an existing item'
+		i = self.index.get(item)
+		if i is None:
+			self.heap.append([priority, next(self.counter), item])
+			self._sift_up(len(self.heap) - 1)
+			return
+		entry = self.heap[i]
+		old_priority = entry[0]
+		entry[0], entry[1] = priority, next(self.counter)
+		if priority < old_priority:
+			self._sift_up(i)
+		else:
+			self._sift_down(i)
+
+	def remove(self, item):
+		'Remove an existing item. Raise KeyError if not found.'
+		i = self.index.pop(item)
+		last = self.heap.pop()
+		if i < len(self.heap):
+			self.heap[i] = last
+			self._sift_up(i)
+			self._sift_down(self.index[last[2]])
+
+	def pop(self):
+		'Remove and return the lowest priority item. Raise KeyError if empty.'
+		if not self.heap:
+			raise KeyError('pop from an empty priority queue')
+		item = self.heap[0][2]
+		del self.index[item]
+		last = self.heap.pop()
+		if self.heap:
+			self.heap[0] = last
+			self._sift_down(0)
+		return item
+
+	def top(self):
+		'Return the lowest priority item and its priority, without removing it'
+		if not self.heap:
+			raise KeyError('top() on an empty priority queue')
+		priority, _, item = self.heap[0]
+		return item, priority
+
+	def _sift_up(self, i):
+		heap, index = self.heap, self.index
+		entry = heap[i]
+		while i > 0:
+			p = (i - 1) >> 1
+			parent = heap[p]
+			if not entry < parent:
+				break
+			heap[i] = parent
+			index[parent[2]] = i
+			i = p
+		heap[i] = entry
+		index[entry[2]] = i
+
+	def _sift_down(self, i):
+		heap, index = self.heap, self.index
+		n = len(heap)
+		entry = heap[i]
+		while True:
+			c = 2 * i + 1
+			if c >= n:
+				break
+			if c + 1 < n and heap[c + 1] < heap[c]:
+				c += 1
+			child = heap[c]
+			if not child < entry:
+				break
+			heap[i] = child
+			index[child[2]] = i
+			i = c
+		heap[i] = entry
+		index[entry[2]] = i
+
+	def priority(self, item):
+		return self.heap[self.index[item]][0]
+
+	def empty(self):
+		return not self.heap
+
+	def __len__(self):
+		return len(self.heap)
+
+	def __contains__(self, item):
+		return item in self.index
+
+	def __str__(self):
+		return str(self.heap)
+
+
+class BucketQueue(object):
+	"""Priority queue for integer priorities, e.g. the f values of a search 
+	with unit costs and an integer heuristic. Items are kept in one bucket per 
+	priority, so push, update and remove take constant time and pop only 
+	has to scan past empty buckets from the smallest priority in the queue.
+
+	Has the same interface as PriorityQueue. Items with equal priorities are 
+	popped in the order in which they were last pushed. Raises ValueError 
+	when pushing a priority that is not an integer.
+	"""
+
+	def __init__(self):
+		super(BucketQueue, self).__init__()
+		self.buckets = {}						# priority -> dict of its items, in insertion order
+		self.priorities = {}					# item -> priority
+		self.min = 0							# no bucket below min is non-empty
+
+	def push(self, item, priority=0):
+		'Add a new item or update the priority of an existing item'
+		p = int(priority)
+		if p != priority:
+			raise ValueError('BucketQueue priorities must be integers, got %r' % (priority,))
+		if item in self.priorities:
+			self.remove(item)
+		self.priorities[item] = p
+		bucket = self.buckets.get(p)
+		if bucket is None:
+			bucket = self.buckets[p] = {}
+		bucket[item] = None
+		if p < self.min or len(self.priorities) == 1:
+			self.min = p
+
+	def remove(self, item):
+		'Remove an existing item. Raise KeyError if not found.'
+		p = self.priorities.pop(item)
+		bucket = self.buckets[p]
+		del bucket[item]
+		if not bucket:
+			del self.buckets[p]
+
+	def pop(self):
+		'Remove and return the lowest priority item. Raise KeyError if empty.'
+		if not self.priorities:
+			raise KeyError('pop from an empty priority queue')
+		item, _ = self.top()
+		self.remove(item)
+		return item
+
+	def top(self):
+		'Return the lowest priority item and its priority, without removing it'
+		if not self.priorities:
+			raise KeyError('top() on an empty priority queue')
+		while self.min not in self.buckets:
+			self.min += 1
+		return next(iter(self.buckets[self.min])), self.min
+
+	def priority(self, item):
+		return self.priorities[item]
+
+	def empty(self):
+		return not self.priorities
+
+	def __len__(self):
+		return len(self.priorities)
+
+	def __contains__(self, item):
+		return item in self.priorities
+
+	def __str__(self):
+		return str(self.buckets)
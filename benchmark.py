@@ -0,0 +1,124 @@
+import os
+from time import perf_counter
+
+import numpy as np
+from BlockMap import BlockMap
+from LDDB import make_lddb, lddb_filename
+from BlockAStarSolver import BlockAStarSolver
+from A_star import a_star
+from Landmarks import LandmarkHeuristic
+from PriorityQueue import PriorityQueue, IndexedHeap, BucketQueue
+from common import generate_random_map, l1_dist, label_components
+
+
+QUEUES = [PriorityQueue, IndexedHeap, BucketQueue]
+
+
+def time_queue_ops(queue, n=10000, updates=4, seed=0):
+	"""Time a synthetic open list workload: push n items, lower the priority
+	of each `updates` times, as A* does when it finds shorter paths, and pop
+	them all, calling top() before every pop as the Block A* main loop does.
+	"""
+	rng = np.random.RandomState(seed)
+	priorities = rng.randint(0, 4 * n, size=(updates + 1, n)).tolist()
+
+	t1 = perf_counter()
+	q = queue()
+	for item, p in enumerate(priorities[0]):
+		q.push(item, p)
+	for ps in priorities[1:]:
+		for item, p in enumerate(ps):
+			if p < q.priority(item):
+				q.push(item, p)
+	while not q.empty():
+		q.top()
+		q.pop()
+	return perf_counter() - t1
+
+
+def time_a_star(queue, h, w, p, runs, seed=0):
+	"""Average time of a_star queries on a random map"""
+	np.random.seed(seed)
+	Map = generate_random_map(h, w, p=p, start_and_goal=False)
+	pairs = _random_pairs(Map, runs)
+	t1 = perf_counter()
+	for start, goal in pairs:
+		a_star(Map, start, goal, l1_dist, queue=queue)
+	return (perf_counter() - t1) / runs
+
+
+def time_block_a_star(queue, lddb, pathsdb, b_sz, h, w, p, runs, seed=0):
+	"""Average time of Block A* queries on a random map"""
+	np.random.seed(seed)
+	Map = generate_random_map(h, w, p=p, start_and_goal=False)
+	pairs = _random_pairs(Map, runs)
+	solver = BlockAStarSolver(BlockMap(Map, b_sz), lddb, pathsdb, queue=queue)
+	t1 = perf_counter()
+	solver.solve_many(pairs)
+	return (perf_counter() - t1) / runs
+
+
+def compare_heuristics(lddb, pathsdb, b_sz, h, w, p, runs, n_landmarks=8, seed=0):
+	"""Average number of nodes expanded by a_star and of blocks expanded by
+	Block A* on a random map, with the L1 and the landmark heuristic. Only
+	connected pairs are used, as for the others both searches exhaust the
+	component of start whatever the heuristic."""
+	np.random.seed(seed)
+	Map = generate_random_map(h, w, p=p, start_and_goal=False)
+	labels = label_components(Map)
+	pairs = [(s, g) for s, g in _random_pairs(Map, runs) if labels[s] == labels[g]]
+	runs = max(len(pairs), 1)
+	block_map = BlockMap(Map, b_sz)
+	heuristics = [('L1', l1_dist), ('landmarks', LandmarkHeuristic(block_map._map, n_landmarks, seed=seed))]
+	out = {}
+	for name, heuristic in heuristics:
+		queue = _counting_queue()
+		for start, goal in pairs:
+			a_star(Map, start, goal, heuristic, queue=queue)
+		solver = BlockAStarSolver(block_map, lddb, pathsdb, h=heuristic)
+		blocks = sum(stats.expansions for _, _, stats in solver.solve_many(pairs))
+		out[name] = (queue.pops / runs, blocks / runs)
+	return out
+
+
+def _counting_queue():
+	"""PriorityQueue class that counts the pops of all its instances"""
+	class CountingQueue(PriorityQueue):
+		pops = 0
+
+		def pop(self):
+			CountingQueue.pops += 1
+			return super(CountingQueue, self).pop()
+	return CountingQueue
+
+
+def _random_pairs(Map, runs):
+	free = np.argwhere(Map == 0)
+	pairs = free[np.random.randint(len(free), size=(runs, 2))]
+	return [(tuple(s.tolist()), tuple(g.tolist())) for s, g in pairs]
+
+
+if __name__ == '__main__':
+	b_sz = 4
+	h, w = 100, 100
+	runs = 50
+
+	print('open list operations')
+	for queue in QUEUES:
+		print('%-14s %e' % (queue.__name__, time_queue_ops(queue)))
+
+	for p in [0., .2, .4]:
+		print('A*, p = %.1f' % p)
+		for queue in QUEUES:
+			print('%-14s %e' % (queue.__name__, time_a_star(queue, h, w, p, runs)))
+
+	lddb, pathsdb = make_lddb(b_sz, from_file=os.path.exists(lddb_filename(b_sz)))
+	for p in [0., .2, .4]:
+		print('Block A*, p = %.1f' % p)
+		for queue in QUEUES:
+			print('%-14s %e' % (queue.__name__, time_block_a_star(queue, lddb, pathsdb, b_sz, h, w, p, runs)))
+
+	print('expansions per query (A* nodes, Block A* blocks)')
+	for p in [.2, .3, .4]:
+		for name, (nodes, blocks) in compare_heuristics(lddb, pathsdb, b_sz, h, w, p, runs).items():
+			print('p = %.1f %-10s %10.1f %10.1f' % (p, name, nodes, blocks))
@@ -46,3 +46,88 @@ def l1_dist(node, goal):
 	y, x = node
 	gy, gx = goal
 	return np.abs(y - gy) + np.abs(x - gx)
+
+
+def l1_dist_batch(ys, xs, goal):
+	"""l1_dist of the nodes (ys[i], xs[i]) from goal, for arrays ys and xs"""
+	gy, gx = goal
+	return np.abs(ys - gy) + np.abs(xs - gx)
+
+
+# heuristics with a `batch` attribute are evaluated for all cells of a block
+# at once by Block A*, see Block_A_star.touch
+l1_dist.batch = l1_dist_batch
+
+
+def chebyshev_dist(node, goal):
+	"""Distance from node to goal with diagonal moves of cost 1"""
+	y, x = node
+	gy, gx = goal
+	return max(abs(y - gy), abs(x - gx))
+
+
+def chebyshev_dist_batch(ys, xs, goal):
+	"""chebyshev_dist of the nodes (ys[i], xs[i]) from goal, for arrays ys and xs"""
+	gy, gx = goal
+	return np.maximum(np.abs(ys - gy), np.abs(xs - gx))
+
+
+chebyshev_dist.batch = chebyshev_dist_batch
+
+
+SQRT2 = float(np.sqrt(2))
+
+
+def octile_dist(node, goal):
+	"""Distance from node to goal with diagonal moves of cost sqrt(2)"""
+	y, x = node
+	gy, gx = goal
+	dy, dx = abs(y - gy), abs(x - gx)
+	return max(dy, dx) + (SQRT2 - 1) * min(dy, dx)
+
+
+def octile_dist_batch(ys, xs, goal):
+	"""octile_dist of the nodes (ys[i], xs[i]) from goal, for arrays ys and xs"""
+	gy, gx = goal
+	dy, dx = np.abs(ys - gy), np.abs(xs - gx)
+	return np.maximum(dy, dx) + (SQRT2 - 1) * np.minimum(dy, dx)
+
+
+octile_dist.batch = octile_dist_batch
+
+
+def label_components(Map):
+	"""Label the 4-connected components of the free cells of Map.
+
+	Components are found with vectorized hooking and pointer jumping: every 
+	pair of adjacent free cells links the larger of their labels to the 
+	smaller one, and labels are then replaced by their labels' labels until 
+	they stop changing. This repeats until adjacent free cells agree.
+
+	Returns:
+		An int array of the shape of Map holding, for each free cell, the 
+		smallest flat index of a cell in its component, and -1 for obstacles.
+	"""
+	free = (np.asarray(Map) == 0)
+	h, w = free.shape
+	ids = np.arange(h * w).reshape(h, w)
+	# pairs of horizontally and vertically adjacent free cells
+	horizontal = free[:, :-1] & free[:, 1:]
+	vertical = free[:-1] & free[1:]
+	a = np.concatenate([ids[:, :-1][horizontal], ids[:-1][vertical]])
+	b = np.concatenate([ids[:, 1:][horizontal], ids[1:][vertical]])
+
+	labels = np.where(free, ids, -1).ravel()
+	while True:
+		la, lb = labels[a], labels[b]
+		differ = la != lb
+		if not differ.any():
+			break
+		np.minimum.at(labels, np.maximum(la, lb)[differ], np.minimum(la, lb)[differ])
+		cells = np.flatnonzero(labels >= 0)
+		while True:
+			jumped = labels[labels[cells]]
+			if (jumped == labels[cells]).all():
+				break
+			labels[cells] = jumped
+	return labels.reshape(h, w)
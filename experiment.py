@@ -6,11 +6,19 @@ from BlockMap import BlockMap
 from LDDB import make_lddb
 from visualizations import *
 from Block_A_star import block_a_star
+from BlockAStarSolver import BlockAStarSolver
 from A_star import a_star
 from common import AttrDict, generate_random_map, l1_dist
 
 
-def experiment(algo, generate_map, data=AttrDict(), preprocessing=lambda m, d: m, maps=500, runs=100, ignore_failures=False):
+def experiment(algo, generate_map, data=AttrDict(), preprocessing=lambda m, d: m, update=None, maps=500, runs=100, ignore_failures=False):
+	"""Time `algo` on random queries on random maps.
+
+	Start and goal cells that are obstacles are made free for the query.
+	By default, the map is preprocessed again for every query where that 
+	changes it. If `update(Map, cells, value)` is given, the map is only 
+	preprocessed once and is instead updated in place.
+	"""
 
 	times = []
 	failure_count = 0
@@ -19,18 +27,32 @@ def experiment(algo, generate_map, data=AttrDict(), preprocessing=lambda m, d: m
 			print(i)
 
 		_m = generate_map()
-		m = _m.copy()
 
 		h, w = _m.shape
 
 		starts = [(np.random.randint(h), np.random.randint(w)) for _ in range(runs)]
 		goals = [(np.random.randint(h), np.random.randint(w)) for _ in range(runs)]
 
+		if update is not None:
+			Map = preprocessing(_m.copy(), data)
+		map_changed = True
+		carved = []
 		for j, (start, goal) in enumerate(zip(starts, goals)):
-			m = m | _m
-			m[start[0], start[1]] = 0
-			m[goal[0], goal[1]] = 0
-			Map = preprocessing(m, data)
+			# the map only differs from _m if start or goal is on an obstacle, 
+			# so only preprocess it again if it or the previous query's map did
+			carve = bool(_m[start[0], start[1]] or _m[goal[0], goal[1]])
+			if update is not None:
+				if carved:
+					update(Map, carved, 1)
+				carved = [n for n in (start, goal) if _m[n[0], n[1]]]
+				if carved:
+					update(Map, carved, 0)
+			elif map_changed or carve:
+				m = _m.copy()
+				m[start[0], start[1]] = 0
+				m[goal[0], goal[1]] = 0
+				Map = preprocessing(m, data)
+			map_changed = carve
 
 			t1 = perf_counter()
 			goal_found, path = algo(Map, start, goal, data)
@@ -62,6 +84,26 @@ def time_block_a_star(b_sz, h, w, p, maps, runs):
 	print('%e' % avg_time, fc)
 
 
+def time_block_a_star_solver(b_sz, h, w, p, maps, runs):
+
+	lddb, pathsdb = make_lddb(b_sz, from_file=True, save_to_file=False)
+
+	data = AttrDict({
+		'block_size': b_sz,
+		'lddb': lddb,
+		'pathsdb': pathsdb,
+		'h': l1_dist
+	})
+	generate_map = lambda: generate_random_map(h, w, p=p, start_and_goal=False)
+	preprocessing = lambda m, d: BlockAStarSolver(BlockMap(m, d.block_size), d.lddb, d.pathsdb, d.h)
+	update = lambda solver, cells, value: solver.block_map.set_cells(cells, value)
+	algo = lambda solver, s, g, d: solver.solve(s, g)[:2]
+
+	avg_time, times, fc = experiment(algo, generate_map=generate_map, data=data, preprocessing=preprocessing, update=update, maps=maps, runs=runs)
+
+	print('%e' % avg_time, fc)
+
+
 def time_a_star(h, w, p, maps, runs):
 
 	data = AttrDict({
@@ -89,3 +131,8 @@ for p in [0., .1, .2, .3, .4, .5]:
 	print(p)
 	np.random.seed(10)
 	time_block_a_star(b_sz=4, h=h, w=w, p=p, maps=maps, runs=runs)
+
+for p in [0., .1, .2, .3, .4, .5]:
+	print(p)
+	np.random.seed(10)
+	time_block_a_star_solver(b_sz=4, h=h, w=w, p=p, maps=maps, runs=runs)
@@ -0,0 +1,60 @@
+import numpy as np
+from BlockMap import BlockMap
+from Block import Block
+from Connectivity import ConnectivityIndex
+from common import label_components
+
+
+def random_edit(block_map, rng):
+	"""Apply a random edit to block_map through one of its update methods"""
+	h, w = block_map._map.shape
+	b = block_map.block_size
+	r = rng.random_sample()
+	if r < 0.5:
+		cells = [(rng.randint(h), rng.randint(w)) for _ in range(rng.randint(1, 4))]
+		block_map.set_cells(cells, rng.random_sample() < 0.5)
+	elif r < 0.8:
+		y, x = rng.randint(h), rng.randint(w)
+		rows, cols = slice(y, min(h, y + rng.randint(1, 6))), slice(x, min(w, x + rng.randint(1, 6)))
+		shape = (rows.stop - rows.start, cols.stop - cols.start)
+		block_map.update_region((rows, cols), rng.random_sample(shape) < rng.random_sample())
+	else:
+		block_map[rng.randint(block_map.h), rng.randint(block_map.w)] = Block(rng.randint(2 ** (b * b)), b)
+
+
+def check_connectivity(block_size, search_limit, seed, edits=40, queries=30):
+	"""Edit a random map and compare the answers of a ConnectivityIndex kept
+	up to date through the edits with the components labeled from scratch"""
+	rng = np.random.RandomState(seed)
+	h, w = rng.randint(5, 40, size=2)
+	block_map = BlockMap((rng.random_sample((h, w)) < rng.random_sample() * 0.6).astype(np.uint8), block_size)
+	index = ConnectivityIndex(block_map, search_limit)
+	for _ in range(edits):
+		random_edit(block_map, rng)
+		labels = label_components(block_map._map)
+		for _ in range(queries):
+			node1 = (rng.randint(h), rng.randint(w))
+			node2 = (rng.randint(h), rng.randint(w))
+			expected = labels[node1] >= 0 and labels[node1] == labels[node2]
+			assert index.connected(node1, node2) == expected, (block_size, seed, node1, node2)
+	index.close()
+	return index.rebuilds
+
+
+def test_connectivity():
+	for block_size in (2, 3, 4, 5):
+		for seed in range(10):
+			# no rebuilds needed after the first build with the default limit
+			assert check_connectivity(block_size, 10000, seed) == 1
+
+
+def test_connectivity_rebuilds():
+	# with a small limit, the searches that give up fall back to rebuilds
+	rebuilds = [check_connectivity(3, 4, seed) for seed in range(10)]
+	assert max(rebuilds) > 1
+
+
+if __name__ == '__main__':
+	test_connectivity()
+	test_connectivity_rebuilds()
+	print('ok')